@@ -14,7 +14,7 @@ setuptools.setup(
     url="https://github.com/OxideGlassGroupAAU/StatMechGlass",
     install_requires=[
         'numpy>=1.16',
-        'scipy>=1.2',
+        'scipy>=1.9',
         'matplotlib>=3.4.2',
         'sklearn',
     ],
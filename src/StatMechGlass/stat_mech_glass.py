@@ -8,10 +8,18 @@ Created on Wed Feb 12 14:40:28 2020
 """
 
 import matplotlib.pyplot as plt
-import csv
 import numpy as np
 import os
 import math
+import time
+import functools
+import contextlib
+import contextvars
+import concurrent.futures
+from multiprocessing import shared_memory
+import hashlib
+import itertools
+from collections.abc import Mapping
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.linear_model import LinearRegression
 import scipy.optimize
@@ -23,24 +31,67 @@ else:
     from . import stat_mech_module as smm
 
 
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Index of the Data and Parameters directories in use, see smg_set_root.
+# STATMECHGLASS_PARAMETERS may name a directory holding a user Parameters
+# directory, which is used before the one of the package
+registry = smm.stat_mech_io.Registry(
+    _PACKAGE_DIR, os.environ.get("STATMECHGLASS_PARAMETERS")
+)
+
+# Consolidated parameter store in use, see smg_use_parameter_store
+parameter_store = None
+
+# Active timing profile of the current thread, see smg_profile
+_profile = contextvars.ContextVar("_profile", default=None)
+
+
+def _timed(phase):
+    """
+    This function will return a decorator which adds the time of every call
+    of the decorated function to the active profile under phase
+    """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            prof = _profile.get()
+            if prof is None:
+                return fun(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                prof.add(phase, time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+
+@_timed("data_load")
 def _data_load(path, file_name, col_nr):
     """
     This function will load the data required by the other functions.
-    It takes a path, file name and the required column as inputs
+    It takes a path, file name and the required column as inputs.
+    The file is parsed once and the column is returned as a read-only view
+    """
+    return _table(path, file_name)[:, col_nr]
+
+
+def _table(path, file_name):
+    """
+    This function will return the contents of a data or parameter file.
+    Parameters are taken from the parameter store if one is in use
     """
-    current_dir = os.getcwd()
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    data_col = []
-    with open(os.path.join(path, f"{file_name}.csv"), newline="") as csvfile:
-        spamreader = csv.reader(csvfile, delimiter=",", quotechar="|")
-        for row in spamreader:
-            data_col.append(row[col_nr])
-    os.chdir(current_dir)
-    data_col = [float(i) for i in data_col]
-    data_col = np.array(data_col)
-    return data_col
+    store = parameter_store
+    directory = path.strip("/").split("/")
+    if store is not None and len(directory) == 2 and (
+        directory[0] == "Parameters"
+    ):
+        return store.get(directory[1], file_name)
+    return registry.load(path, file_name)
 
 
+@_timed("form_lookup")
 def _form_lookup(former, modifier=None, path_in=None):
     """
     This function is used to lookup the correct terms and formers when
@@ -56,6 +107,7 @@ def _form_lookup(former, modifier=None, path_in=None):
             smm.stat_mech_silicate.Si_SSE,
             smm.stat_mech_silicate.Si_onedraw,
         )
+        batch_draw_fun = smm.stat_mech_silicate.Si_onedraw_batch
         if modifier:
             if path_in:
                 dat = (
@@ -80,6 +132,7 @@ def _form_lookup(former, modifier=None, path_in=None):
         atom_frac = 2
         data_q = ["Si4", "Si3", "Si2", "Si1", "Si0"]
         first_draw = None
+        first_draw_batch = None
 
     elif former == "B":
         path = "Parameters/B2O3"
@@ -89,6 +142,7 @@ def _form_lookup(former, modifier=None, path_in=None):
             smm.stat_mech_borate.B_SSE,
             smm.stat_mech_borate.B_onedraw,
         )
+        batch_draw_fun = smm.stat_mech_borate.B_onedraw_batch
         if modifier:
             if path_in:
                 dat = (_data_load(path_in, fil, 0), _data_load(path_in, fil, 1))
@@ -99,6 +153,7 @@ def _form_lookup(former, modifier=None, path_in=None):
         atom_frac = 1
         data_q = ["B4"]
         first_draw = None
+        first_draw_batch = None
 
     elif former == "Al":
         path = "Parameters/Al2O3"
@@ -109,6 +164,8 @@ def _form_lookup(former, modifier=None, path_in=None):
             smm.stat_mech_aluminoborate.AlB_one_draw,
             smm.stat_mech_aluminoborate.AlB_first_draw,
         )
+        batch_draw_fun = smm.stat_mech_aluminoborate.AlB_one_draw_batch
+        first_draw_batch = smm.stat_mech_aluminoborate.AlB_first_draw_batch
         if modifier:
             if path_in:
                 dat = (_data_load(path_in, fil, 0), _data_load(path_in, fil, 1))
@@ -127,6 +184,7 @@ def _form_lookup(former, modifier=None, path_in=None):
             smm.stat_mech_phosphate.P_SSE,
             smm.stat_mech_phosphate.P_onedraw,
         )
+        batch_draw_fun = smm.stat_mech_phosphate.P_onedraw_batch
         if modifier:
             if path_in:
                 dat = (
@@ -149,6 +207,7 @@ def _form_lookup(former, modifier=None, path_in=None):
         atom_frac = 1
         data_q = ["p3", "p2", "p1", "p0"]
         first_draw = None
+        first_draw_batch = None
 
     elif former == "AlB":
         path = "Data/Al2O3B2O3"
@@ -196,9 +255,27 @@ def _form_lookup(former, modifier=None, path_in=None):
         path2,
         data_q,
         first_draw,
+        batch_draw_fun,
+        first_draw_batch,
     )
 
 
+def _file_stats(files):
+    """
+    This function will return the modification time and size of each file.
+    Missing files are returned as None
+    """
+    stats = []
+    for i in files:
+        try:
+            st = os.stat(i)
+        except OSError:
+            stats.append(None)
+        else:
+            stats.append((st.st_mtime_ns, st.st_size))
+    return tuple(stats)
+
+
 def _tg_fit(tg_data, mod):
     """
     This function takes Tg and modifier data to fit the Tg values as 
@@ -222,14 +299,932 @@ def _tg_fit(tg_data, mod):
     return tg
 
 
-def smg_structure(val, tg, p=None):
+# Draw trajectories shared between glasses of the same former ratio,
+# modifier mix and tg
+trajectory_cache = smm.stat_mech_cache.LRUCache(maxsize=256)
+
+# States after the first draw of the intermediates, shared between glasses
+# of the same intermediate/former ratio and tg
+first_draw_cache = smm.stat_mech_cache.LRUCache(maxsize=1024)
+
+# Results of smg_structure and compiled glass systems
+structure_cache = smm.stat_mech_cache.LRUCache(maxsize=4096)
+_system_cache = smm.stat_mech_cache.LRUCache(maxsize=64)
+
+# Optional persistent cache, see smg_enable_disk_cache
+disk_cache = None
+
+_COMP = {
+    "formers": ["Si", "B", "P"],
+    "intermediates": ["Al"],
+    "modifiers": ["Na", "K", "Li", "Ca"],
+}
+
+
+class StructureResult(Mapping):
+    """
+       This class holds the structural distribution calculated by the
+       structure functions. The concentrations are stored in a numpy array
+       with one column per structural species, and the species can be looked
+       up by name like in a python dictionary.
+
+    =============================================================================
+       StructureResult(species, index, array)
+    =============================================================================
+
+       where species is a tuple of the species names, index is a dictionary
+       of species names to column numbers and array is the float array of
+       concentrations. For a single glass the array has the shape (species,),
+       for many glasses (N x species) and for many glasses under many
+       parameter variants (K x N x species).
+
+
+       Example:
+
+       >>> res_structures = smg_structure({"Si":25, "B": 25, "Na":50}, tg=700)
+       >>> res_structures["Si4"]
+       >>> res_structures.to_dict()
+    """
+
+    __slots__ = ("species", "index", "array")
+
+    def __init__(self, species, index, array):
+        self.species = species
+        self.index = index
+        self.array = np.asarray(array, dtype=np.float64)
+
+    def __getitem__(self, key):
+        if self.array.ndim == 1:
+            return self.array[self.index[key]]
+        return self.array[..., self.index[key]]
+
+    def __iter__(self):
+        return iter(self.species)
+
+    def __len__(self):
+        return len(self.species)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        """
+        This function will return the structures as a python dictionary of
+        species names and concentrations
+        """
+        return {i: self[i] for i in self.species}
+
+
+class GlassSystem:
+    """
+       This class holds a compiled glass composition system. All formers,
+       intermediates and modifiers of the system are resolved once, together
+       with their enthalpies and MF factors, so that the structural
+       distribution can be calculated repeatedly without any file access.
+
+    =============================================================================
+       GlassSystem(components, p = None, parameters = None)
+    =============================================================================
+
+       where components is an iterable of the component names in the glass,
+       such as ["Si", "B", "Na", "K"]. A composition dictionary such as
+       {"Si":25,"B":25,"Na":50} may also be used.
+       Please refer to the README file for elaboration on the naming convention
+
+       p is only used when the system is built by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+
+       Example:
+
+       >>> system = GlassSystem(["Si", "B", "Na", "K"])
+       >>> res_structures = system.structure({"Si":25, "B":25, "Na":50}, 700)
+    """
+
+    def __init__(self, components, p=None, parameters=None):
+        self.formers = [i for i in _COMP["formers"] if i in components]
+        self.intermediates = [
+            i for i in _COMP["intermediates"] if i in components
+        ]
+        self.modifiers = [i for i in _COMP["modifiers"] if i in components]
+        self.components = list(components)
+        self.p = p
+        self.parameters = _parameter_set(parameters)
+        self.files = []
+        # Every parameter table used by the system, see _load
+        self.tables = {}
+
+        # Intermediates are drawn as formers after the first draw
+        self.draw_formers = self.formers + self.intermediates
+
+        self.atom_frac = []
+        self.start_conc = []
+        self.struc_keys = []
+        self.w_names = []
+        self.onedraw = []
+        self.batch_draw = []
+        for i in self.draw_formers:
+            lookup = _form_lookup(i)
+            self.atom_frac.append(lookup[6])
+            self.start_conc.append(lookup[4])
+            self.struc_keys.append(list(lookup[4].keys()))
+            self.w_names.append(lookup[5])
+            self.onedraw.append(lookup[3])
+            self.batch_draw.append(lookup[11])
+        self.species = tuple(i2 for i in self.struc_keys for i2 in i)
+        self.index = {i: ind for ind, i in enumerate(self.species)}
+        self.offsets = [0]
+        for i in self.struc_keys:
+            self.offsets.append(self.offsets[-1] + len(i))
+
+        # MF factors relative to the first former
+        self.mf = []
+        for i2 in range(len(self.draw_formers)):
+            if i2 == 0:
+                self.mf.append(1)
+            elif p:
+                self.mf.append(float(np.squeeze(p)))
+            else:
+                f_p = self.draw_formers[0] + self.draw_formers[i2]
+                self.mf.append(self._load("Parameters/MF", f_p)[0])
+
+        # Modifier/former enthalpies
+        self.enthalpies = {}
+        for i in self.modifiers:
+            self.enthalpies[i] = [
+                self._load(_form_lookup(i2)[0], i)
+                for i2 in self.draw_formers
+            ]
+
+        # Dense enthalpy table (modifier x former x weight). The first weight
+        # of every former is the reference with zero enthalpy, and unused
+        # weights are set to infinity so that their Boltzmann weight is zero
+        self.n_w = max(len(i) for i in self.w_names)
+        self.H = np.full((len(self.modifiers), len(self.draw_formers),
+                          self.n_w), np.inf)
+        self.H[:, :, 0] = 0
+        for i in range(len(self.modifiers)):
+            for i2 in range(len(self.draw_formers)):
+                Hi = self.enthalpies[self.modifiers[i]][i2]
+                if len(Hi) > 1:
+                    self.H[i, i2, 1:len(Hi) + 1] = Hi
+
+        # Former/intermediate enthalpies for the first draw
+        self.H_int = []
+        int_names = []
+        self.first_draw = None
+        self.first_draw_batch = None
+        if len(self.intermediates) > 0:
+            for i in self.draw_formers:
+                path = _form_lookup(i)[0]
+                w_data = list(self._load(path, self.intermediates[0]))
+                self.H_int.extend(w_data)
+                int_names.extend(
+                    f"{path[11:]}/{self.intermediates[0]}[{i2}]"
+                    for i2 in range(len(w_data))
+                )
+            lookup = _form_lookup(self.intermediates[0])
+            self.first_draw = lookup[10]
+            self.first_draw_batch = lookup[12]
+
+        # Names and values of all parameters as one vector, in the order
+        # used by structure_variants
+        self.par_names = []
+        self.par_values = []
+        for i in range(len(self.modifiers)):
+            for i2 in range(len(self.draw_formers)):
+                Hi = self.enthalpies[self.modifiers[i]][i2]
+                if len(Hi) > 1:
+                    name = (f"{_form_lookup(self.draw_formers[i2])[0][11:]}/"
+                            f"{self.modifiers[i]}")
+                    self.par_names.extend(
+                        f"{name}[{i3}]" for i3 in range(len(Hi))
+                    )
+                    self.par_values.extend(float(i3) for i3 in Hi)
+        for i in range(1, len(self.draw_formers)):
+            self.par_names.append(
+                f"MF/{self.draw_formers[0]}{self.draw_formers[i]}"
+            )
+            self.par_values.append(float(self.mf[i]))
+        self.par_names.extend(int_names)
+        self.par_values.extend(float(i) for i in self.H_int)
+
+        # Fingerprint of the resolved parameters
+        fp = hashlib.sha1(repr((self.species, self.modifiers)).encode())
+        fp.update(self.H.tobytes())
+        fp.update(np.array(self.mf, dtype=float).tobytes())
+        fp.update(np.array(self.H_int, dtype=float).tobytes())
+        self.fingerprint = fp.hexdigest()
+        self.file_stats = _file_stats(self.files)
+
+    def _load(self, path, file_name):
+        """
+        This function will load the first column of a parameter file and
+        record the file, so that changes to it can be detected. Parameters
+        of the in-memory parameter set of the system are used instead.
+        The column is also recorded in self.tables
+        """
+        directory = path.strip("/").split("/")[1]
+        if self.parameters is not None and (
+            (directory, file_name) in self.parameters
+        ):
+            table = self.parameters.get(directory, file_name)[:, 0]
+            self.tables[f"{directory}/{file_name}"] = table
+            return table
+        table = _data_load(path, file_name, 0)
+        self.tables[f"{directory}/{file_name}"] = table
+        store = parameter_store
+        if store is not None and path.strip("/").startswith("Parameters/"):
+            if store.path is not None:
+                self.files.append(store.path)
+        else:
+            # Every path the file may have is recorded, so that a file
+            # written to the parameter root later is detected
+            self.files.extend(registry.candidates(path, file_name))
+        return table
+
+    def is_current(self):
+        """
+        This function will return False if any of the parameter files of the
+        system have been changed since the system was compiled
+        """
+        return _file_stats(self.files) == self.file_stats
+
+    def structure(self, val, tg, cache=True):
+        """
+        This function will calculate the structural distribution of a glass
+        composition val in the system at the temperature tg.
+        Refer to smg_structure for details
+
+        Glasses with the same former ratio, modifier mix and tg follow the
+        same draw trajectory. When cache is True, the trajectory is stored in
+        trajectory_cache and later glasses resume from the stored states
+        """
+        prof = _profile.get()
+        if prof is not None:
+            t0 = time.perf_counter()
+        f_conc = [
+            val[self.draw_formers[i]] / self.atom_frac[i]
+            for i in range(len(self.draw_formers))
+        ]
+        m_conc = [val[i] for i in self.modifiers]
+        if prof is not None:
+            prof.add("parse", time.perf_counter() - t0)
+
+        if sum(f_conc[len(self.formers):]) > sum(f_conc[:len(self.formers)]):
+            print(
+                "The results may be inaccurate since the concentration of"
+                "intermediates is higher than the concentration of formers"
+                )
+
+        t_n_draws = (sum(m_conc) / sum(f_conc)) * 100
+
+        n_draws = int(t_n_draws)
+
+        if t_n_draws - n_draws > 0.5:
+            n_draws += 1
+
+        if n_draws == 0 or not cache:
+            conc = self._start(f_conc, tg)
+            if n_draws > 0:
+                weights, draw_w = self._mixed_weights(m_conc, tg)
+            for m in range(n_draws):
+                self._draw(conc, weights, draw_w)
+            return StructureResult(self.species, self.index, np.array(conc))
+
+        key = (
+            self.fingerprint,
+            tuple(round(i / sum(f_conc), 12) for i in f_conc),
+            tuple(round(i / sum(m_conc), 12) for i in m_conc),
+            float(tg),
+        )
+        trajectory = trajectory_cache.get(key)
+        if trajectory is None:
+            weights, draw_w = self._mixed_weights(m_conc, tg)
+            trajectory = (weights, draw_w, (tuple(self._start(f_conc, tg)),))
+
+        weights, draw_w, states = trajectory
+        if n_draws >= len(states):
+            conc = list(states[-1])
+            new_states = []
+            for m in range(len(states) - 1, n_draws):
+                self._draw(conc, weights, draw_w)
+                new_states.append(tuple(conc))
+            states = states + tuple(new_states)
+            trajectory_cache.put(key, (weights, draw_w, states))
+
+        return StructureResult(self.species, self.index,
+                               np.array(states[n_draws]))
+
+    def _start(self, f_conc, tg):
+        """
+        This function will return the starting concentrations of the glass,
+        indexed as self.species, after the first draw of the intermediates
+        """
+        conc = []
+        for i in range(len(self.draw_formers)):
+            for i2 in self.start_conc[i].values():
+                conc.append(i2 * f_conc[i] / sum(f_conc))
+
+        # Glasses without the intermediate or the first former are left
+        # unchanged, as in first_draw_batch
+        if (len(self.intermediates) > 0 and f_conc[0] > 0
+                and f_conc[len(self.formers)] > 0):
+            prof = _profile.get()
+            if prof is not None:
+                t0 = time.perf_counter()
+            structure_alb = self._first_draw(conc, tg)
+            if prof is not None:
+                prof.add("first_draw", time.perf_counter() - t0)
+
+            for i in range(len(conc)):
+                conc[i] = structure_alb[i]
+
+        return conc
+
+    def _first_draw(self, conc, tg):
+        """
+        This function will return the concentrations after the first draw of
+        the intermediates. The result only depends on the starting
+        concentrations, which are set by the intermediate/former ratio, and
+        on tg, so it is memoized in first_draw_cache
+        """
+        key = (self.fingerprint, tuple(round(i, 12) for i in conc), float(tg))
+        structure_alb = first_draw_cache.get(key)
+        if structure_alb is None:
+            w_int = []
+
+            for i in range(len(self.H_int)):
+                w_int.append(math.exp(-self.H_int[i] / (tg * 0.008314)))
+
+            structure_alb = self.first_draw(w_int, conc, self.draw_formers[0])
+            if structure_alb is not None:
+                structure_alb = tuple(structure_alb)
+                first_draw_cache.put(key, structure_alb)
+
+        return structure_alb
+
+    def _mixed_weights(self, m_conc, tg):
+        """
+        This function will return the modifier averaged weights used by the
+        draws and the weights used for the draw sizes of each former
+        """
+        table = self.weight_table(tg)
+        m_frac = np.array(m_conc) / sum(m_conc)
+        weights = np.tensordot(m_frac, table, axes=1).tolist()
+        draw_w = table.sum(axis=0).tolist()
+        return weights, draw_w
+
+    def _draw(self, conc, weights, draw_w, onedraw=None):
+        """
+        This function will perform one draw of modifier on all formers.
+        Formers which are absent from the glass are not drawn, as in
+        _draw_batch. onedraw replaces the draw functions of the formers,
+        such as batch_draw for concentrations and weights that are Duals
+        """
+        formers = self.draw_formers
+        intermediates = self.intermediates
+
+        draws = []
+        present = []
+        for i in range(len(formers)):
+            o = self.offsets[i]
+            draw = 0
+            for i2 in range(len(self.w_names[i])):
+                draw += draw_w[i][i2] * conc[o + i2]
+            draws.append(draw)
+            present.append(sum(conc[o:o + len(self.struc_keys[i])]) > 0)
+            if present[i] and draw == 0 and formers[i] not in intermediates:
+                raise ZeroDivisionError(
+                    f"{formers[i]} has no units left to draw on, the "
+                    "modifier content of the glass is too high"
+                )
+
+        draws_norm = []
+        for i in range(len(draws)):
+            draws_norm.append((draws[i] / sum(draws)))
+
+        for i in range(len(formers)):
+            if not present[i]:
+                continue
+            self._step(conc, weights, i, draws_norm[i], onedraw=onedraw)
+
+            if formers[i] in intermediates:
+                back_draw = -draws_norm[i] * 3
+
+                for i2 in range(len(formers)):
+                    if formers[i2] not in intermediates and present[i2]:
+                        self._step(conc, weights, i2, back_draw, back=True,
+                                   onedraw=onedraw)
+
+    def structure_batch(self, compositions, tg, components=None):
+        """
+        This function will calculate the structural distribution of many
+        glass compositions in the system at once. compositions is an
+        (N x components) array with the columns in the order of components
+        (by default the components of the system), and tg is a single value
+        or an array of N values. All glasses are drawn in lockstep, and
+        glasses which have reached their number of draws are left out.
+        Returns a StructureResult with an (N x species) array
+        """
+        state = self._draw_rows(*self._start_batch(compositions, tg,
+                                                   components))
+
+        return StructureResult(self.species, self.index, state.T.copy())
+
+    def _start_batch(self, compositions, tg, components=None, tables=None):
+        """
+        This function will return the starting state of many glasses as a
+        (species x glasses) array, together with the weights, the draw
+        weights, the formers present in each glass and the number of draws.
+        tables is an optional tuple of enthalpies, MF factors and
+        intermediate enthalpies with one entry per glass, which replace
+        those of the system
+        """
+        formers = self.draw_formers
+
+        prof = _profile.get()
+        if prof is not None:
+            t0 = time.perf_counter()
+        comps = np.array(compositions, dtype=float, ndmin=2)
+        n_glass = comps.shape[0]
+        tg = np.broadcast_to(np.asarray(tg, dtype=float), (n_glass,))
+        if components is None:
+            components = self.components
+        col = {c: i for i, c in enumerate(components)}
+
+        f_conc = np.zeros((n_glass, len(formers)))
+        for i in range(len(formers)):
+            f_conc[:, i] = comps[:, col[formers[i]]] / self.atom_frac[i]
+        m_conc = np.zeros((n_glass, len(self.modifiers)))
+        for i in range(len(self.modifiers)):
+            m_conc[:, i] = comps[:, col[self.modifiers[i]]]
+        f_sum = f_conc.sum(axis=1)
+        m_sum = m_conc.sum(axis=1)
+        if prof is not None:
+            prof.add("parse", time.perf_counter() - t0)
+
+        if np.any(f_conc[:, len(self.formers):].sum(axis=1) >
+                  f_conc[:, :len(self.formers)].sum(axis=1)):
+            print(
+                "The results may be inaccurate since the concentration of"
+                "intermediates is higher than the concentration of formers"
+                )
+
+        t_n_draws = (m_sum / f_sum) * 100
+        n_draws = t_n_draws.astype(int)
+        n_draws[t_n_draws - n_draws > 0.5] += 1
+
+        # Starting concentrations as a (species x glasses) array
+        state = np.zeros((len(self.species), n_glass))
+        for i in range(len(formers)):
+            o = self.offsets[i]
+            start_conc = np.array(list(self.start_conc[i].values()), float)
+            state[o:o + len(start_conc)] = (
+                start_conc[:, None] * (f_conc[:, i] / f_sum)
+            )
+
+        if tables is None:
+            tables = (self.H, self.mf, np.array(self.H_int)[None, :])
+        H, mf, H_int = tables
+
+        if len(self.intermediates) > 0:
+            w_int = np.exp(-H_int / (tg[:, None] * 0.008314))
+            if prof is not None:
+                t0 = time.perf_counter()
+            state = np.array(self.first_draw_batch(w_int.T, state,
+                                                   formers[0]))
+            if prof is not None:
+                prof.add("first_draw", time.perf_counter() - t0, n_glass)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            table = self.weight_table(tg, H, mf)
+            m_frac = m_conc / m_sum[:, None]
+            weights = np.einsum("nm,nmfw->nfw", m_frac, table)
+            draw_w = table.sum(axis=1)
+
+        return state, weights, draw_w, f_conc > 0, n_draws
+
+    def structure_variants(self, variants, compositions, tg,
+                           components=None):
+        """
+        This function will calculate the structural distribution of many
+        glass compositions under many variants of the parameters at once.
+        variants is a (K x parameters) array in the order of par_names,
+        compositions an (N x components) array as for structure_batch and
+        tg a single value or an array of N values. The weight tables of all
+        variants are built in one pass and all K x N glasses are drawn in
+        lockstep. Returns a StructureResult with a (K x N x species) array
+        """
+        variants = np.array(variants, dtype=float, ndmin=2)
+        if variants.shape[1] != len(self.par_names):
+            raise ValueError(
+                f"The variants have {variants.shape[1]} parameters, the "
+                f"system has {len(self.par_names)}: "
+                f"{', '.join(self.par_names)}"
+            )
+        comps = np.array(compositions, dtype=float, ndmin=2)
+        n_var, n_glass = len(variants), len(comps)
+        tg = np.broadcast_to(np.asarray(tg, dtype=float), (n_glass,))
+
+        # Enthalpies and MF factors of each variant
+        H = np.repeat(self.H[None], n_var, axis=0)
+        mf = np.repeat(np.array(self.mf, dtype=float)[None], n_var, axis=0)
+        col = 0
+        for i in range(len(self.modifiers)):
+            for i2 in range(len(self.draw_formers)):
+                n = len(self.enthalpies[self.modifiers[i]][i2])
+                if n > 1:
+                    H[:, i, i2, 1:n + 1] = variants[:, col:col + n]
+                    col += n
+        n = len(self.draw_formers) - 1
+        mf[:, 1:] = variants[:, col:col + n]
+        H_int = variants[:, col + n:]
+
+        rows = np.repeat(np.arange(n_var), n_glass)
+        state = self._draw_rows(*self._start_batch(
+            np.tile(comps, (n_var, 1)), np.tile(tg, n_var), components,
+            (H[rows], mf[rows], H_int[rows]),
+        ))
+
+        return StructureResult(self.species, self.index,
+                               state.T.reshape(n_var, n_glass, -1).copy())
+
+    def _draw_rows(self, state, weights, draw_w, present, n_draws):
+        """
+        This function will draw every glass of state its number of draws
+        and return the final (species x glasses) state. The glasses are
+        sorted by their number of draws, longest first, so that the glasses
+        still drawing are a prefix and only that prefix is drawn
+        """
+        order = np.argsort(-n_draws, kind="stable")
+        state = state[:, order]
+        weights, draw_w, present = weights[order], draw_w[order], present[order]
+        n_draws = n_draws[order]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for m in range(n_draws.max(initial=0)):
+                k = np.count_nonzero(n_draws > m)
+                self._draw_batch(state[:, :k], weights[:k], draw_w[:k],
+                                 present[:k])
+
+        out = np.empty_like(state)
+        out[:, order] = state
+        return out
+
+    def _draw_batch(self, state, weights, draw_w, mask):
+        """
+        This function will perform one draw of modifier on all formers of
+        the glasses in state. mask is a (glasses x formers) array which
+        selects the formers that are drawn in each glass
+        """
+        formers = self.draw_formers
+        intermediates = self.intermediates
+
+        draws = np.zeros((len(formers), state.shape[1]))
+        for i in range(len(formers)):
+            o = self.offsets[i]
+            n_w = len(self.w_names[i])
+            draws[i] = np.einsum("nw,wn->n", draw_w[:, i, :n_w],
+                                 state[o:o + n_w])
+
+        draws_norm = draws / draws.sum(axis=0)
+
+        for i in range(len(formers)):
+            self._step_batch(state, weights, i, draws_norm[i], mask[:, i])
+
+            if formers[i] in intermediates:
+                back_draw = -draws_norm[i] * 3
+
+                for i2 in range(len(formers)):
+                    if formers[i2] not in intermediates:
+                        self._step_batch(state, weights, i2, back_draw,
+                                         mask[:, i2], back=True)
+
+    def composition_map(self, step, tg, components=None):
+        """
+        This function will calculate the structural distribution over the
+        whole composition simplex of the components of the system with a
+        grid spacing of step mol%. The grid columns are in the order of
+        components, by default the components of the system. Grid points with the same former ratio and
+        modifier mix lie on one ray and share the draw trajectory, so every
+        ray is drawn once and the points are read off at their number of
+        draws. The rays are drawn in lockstep, longest first.
+        Returns the (N x components) grid and a StructureResult with an
+        (N x species) array. Points without formers are set to nan
+        """
+        n_step = int(round(100 / step))
+        if n_step < 1 or not math.isclose(n_step * step, 100):
+            raise ValueError("step must divide 100")
+        if components is None:
+            components = self.components
+        components = list(components)
+        if sorted(components) != sorted(self.components):
+            raise ValueError(
+                f"The components {components} are not those of the system "
+                f"{self.components}"
+            )
+
+        # All integer points summing to n_step (stars and bars)
+        n_comp = len(components)
+        bars = np.array(
+            list(itertools.combinations(range(n_step + n_comp - 1),
+                                        n_comp - 1)),
+            dtype=int,
+        ).reshape(-1, n_comp - 1)
+        edges = np.column_stack([
+            np.full(len(bars), -1), bars,
+            np.full(len(bars), n_step + n_comp - 1),
+        ])
+        grid = (np.diff(edges, axis=1) - 1) * step
+
+        col = {c: i for i, c in enumerate(components)}
+        f_conc = np.column_stack([
+            grid[:, col[self.draw_formers[i]]] / self.atom_frac[i]
+            for i in range(len(self.draw_formers))
+        ])
+        m_conc = grid[:, [col[i] for i in self.modifiers]]
+        f_sum = f_conc.sum(axis=1)
+        m_sum = m_conc.sum(axis=1)
+        valid = np.flatnonzero(f_conc[:, :len(self.formers)].sum(axis=1) > 0)
+
+        t_n_draws = (m_sum[valid] / f_sum[valid]) * 100
+        n_draws = t_n_draws.astype(int)
+        n_draws[t_n_draws - n_draws > 0.5] += 1
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            m_mix = np.nan_to_num(m_conc[valid] / m_sum[valid, None])
+        keys = np.round(
+            np.column_stack([f_conc[valid] / f_sum[valid, None], m_mix]), 12
+        )
+        keys, ray = np.unique(keys, axis=0, return_inverse=True)
+        ray = ray.ravel()
+
+        # Each ray is drawn from the grid point with the most draws, and the
+        # rays are sorted so that the rays still drawing are a prefix
+        ray_draws = np.zeros(len(keys), dtype=int)
+        np.maximum.at(ray_draws, ray, n_draws)
+        ray_point = np.zeros(len(keys), dtype=int)
+        ray_point[ray[n_draws == ray_draws[ray]]] = np.flatnonzero(
+            n_draws == ray_draws[ray]
+        )
+        order = np.argsort(-ray_draws, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        state, weights, draw_w, present, ray_draws = self._start_batch(
+            grid[valid][ray_point[order]], tg, components
+        )
+
+        out = np.full((len(grid), len(self.species)), np.nan)
+        stop = np.argsort(n_draws, kind="stable")
+        bounds = np.searchsorted(n_draws[stop],
+                                 np.arange(ray_draws.max(initial=0) + 2))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for m in range(ray_draws.max(initial=0) + 1):
+                points = stop[bounds[m]:bounds[m + 1]]
+                out[valid[points]] = state[:, rank[ray[points]]].T
+
+                k = np.count_nonzero(ray_draws > m)
+                if k > 0:
+                    self._draw_batch(state[:, :k], weights[:k], draw_w[:k],
+                                     present[:k])
+
+        return grid, StructureResult(self.species, self.index, out)
+
+    def structure_jacobian(self, val, tg):
+        """
+        This function will calculate the structural distribution of the
+        glass composition val at the temperature tg together with its
+        derivatives with respect to the amount of each component in val and
+        to tg. The amounts and tg are Duals with one direction each, and the
+        derivatives are carried through the start, the first draw of the
+        intermediates and every draw by the batch draw functions. A
+        concentration that is clamped to 0 has no derivative. The number of
+        draws is an integer, so its dependence on the composition is taken
+        from the change of the structure in one more draw.
+        Returns the structure, an (components x species) array of
+        d(species)/d(component) and a (species,) array of d(species)/d(tg)
+        """
+        Dual = smm.stat_mech_util.Dual
+        formers = self.draw_formers
+        components = list(val)
+        absent = [c for c in formers if val[c] <= 0]
+        if absent or sum(val[i] for i in self.modifiers) <= 0:
+            raise ValueError(
+                "The derivatives are only defined for glasses with every "
+                "former and some modifier, the glass has no "
+                f"{', '.join(absent) if absent else 'modifier'}"
+            )
+        n_comp = len(components)
+        unit = np.eye(n_comp + 1)
+        x = {c: Dual(float(val[c]), unit[j]) for j, c in enumerate(components)}
+        tg = Dual(float(tg), unit[-1])
+
+        f_conc = [x[formers[i]] / self.atom_frac[i]
+                  for i in range(len(formers))]
+        m_conc = [x[i] for i in self.modifiers]
+        f_sum = sum(f_conc)
+        m_sum = sum(m_conc)
+
+        t_n_draws = (m_sum.v / f_sum.v) * 100
+        n_draws = int(t_n_draws)
+        if t_n_draws - n_draws > 0.5:
+            n_draws += 1
+
+        conc = []
+        for i in range(len(formers)):
+            for i2 in self.start_conc[i].values():
+                conc.append(i2 * f_conc[i] / f_sum)
+
+        if (len(self.intermediates) > 0 and f_conc[0] > 0
+                and f_conc[len(self.formers)] > 0):
+            w_int = []
+            for H in self.H_int:
+                w = math.exp(-H / (tg.v * 0.008314))
+                w_int.append(Dual(w, w * H / (0.008314 * tg.v ** 2) * tg.d))
+            conc = self.first_draw_batch(w_int, conc, formers[0])
+
+        # Weights, with d(exp(-H/(R tg)))/d(tg) = exp(-H/(R tg)) H/(R tg^2)
+        table = self.weight_table(tg.v)
+        d_table = (table * np.where(np.isinf(self.H), 0, self.H)
+                   / (0.008314 * tg.v ** 2))
+        m_frac = [i / m_sum for i in m_conc]
+        weights = []
+        draw_w = []
+        for i in range(len(formers)):
+            weights.append([])
+            draw_w.append([])
+            for i2 in range(self.n_w):
+                weights[i].append(sum(
+                    m_frac[m] * Dual(float(table[m, i, i2]),
+                                     d_table[m, i, i2] * tg.d)
+                    for m in range(len(self.modifiers))
+                ))
+                draw_w[i].append(Dual(float(table[:, i, i2].sum()),
+                                      d_table[:, i, i2].sum() * tg.d))
+
+        for m in range(n_draws):
+            self._draw(conc, weights, draw_w, onedraw=self.batch_draw)
+
+        values = np.array([smm.stat_mech_util.value(i) for i in conc])
+        d = np.zeros((n_comp + 1, len(self.species)))
+        for i in range(len(conc)):
+            if isinstance(conc[i], Dual):
+                d[:, i] = conc[i].d
+
+        # Change of the structure in one more draw
+        after = values.tolist()
+        self._draw(after, *self._mixed_weights([i.v for i in m_conc], tg.v))
+        rate = np.array(after) - values
+
+        # Number of draws as a continuous function of the composition
+        d_draws = np.zeros(n_comp)
+        for j, c in enumerate(components):
+            if c in self.modifiers:
+                d_draws[j] = 100 / f_sum.v
+            elif c in formers:
+                i = formers.index(c)
+                d_draws[j] = (-100 * m_sum.v / f_sum.v ** 2
+                              / self.atom_frac[i])
+
+        d_comp = d[:n_comp] + d_draws[:, None] * rate
+
+        return (StructureResult(self.species, self.index, values), d_comp,
+                d[-1].copy())
+
+    def structure_sweep(self, val, tg):
+        """
+        This function will calculate the structural distribution of a single
+        glass composition val at every temperature in the array tg in one
+        vectorized pass. Returns an (n_tg x species) array with the columns
+        in the order of the species of the system
+        """
+        tg = np.asarray(tg, dtype=float).ravel()
+        row = [val[i] for i in self.components]
+
+        return self.structure_batch(np.tile(row, (len(tg), 1)), tg).array
+
+    def weight_table(self, tg, H=None, mf=None):
+        """
+        This function will return the Boltzmann weights of the system at the
+        temperature tg as a dense array with the shape
+        (modifiers, formers, weights). The MF factors are included.
+        If tg is an array, the weight tables are stacked along the
+        leading axes. H and mf replace the enthalpies and MF factors of the
+        system and may also be stacked along leading axes
+        """
+        tg = np.asarray(tg, dtype=float)[..., None, None, None]
+        if H is None:
+            H = self.H
+        if mf is None:
+            mf = self.mf
+        mf = np.asarray(mf, dtype=float)[..., None, :, None]
+        return np.exp(-H / (tg * 0.008314)) * mf
+
+    def _step_batch(self, state, weights, i, draw_size, mask, back=False):
+        """
+        This function will perform a single draw on former i of the glasses
+        selected by mask
+        """
+        prof = _profile.get()
+        if prof is not None:
+            t0 = time.perf_counter()
+        o = self.offsets[i]
+        n = len(self.struc_keys[i])
+        step_w = weights[:, i, :len(self.w_names[i])].T
+
+        if back:
+            new_conc = self.batch_draw[i](step_w, state[o:o + n], draw_size,
+                                          back=True)
+        else:
+            new_conc = self.batch_draw[i](step_w, state[o:o + n], draw_size)
+
+        state[o:o + n] = np.where(mask, np.array(new_conc), state[o:o + n])
+        if prof is not None:
+            prof.add("back_draws" if back else "forward_draws",
+                     time.perf_counter() - t0)
+
+    def _step(self, conc, weights, i, draw_size, back=False, onedraw=None):
+        """
+        This function will perform a single draw on former i of the system
+        """
+        prof = _profile.get()
+        if prof is not None:
+            t0 = time.perf_counter()
+        o = self.offsets[i]
+        n = len(self.struc_keys[i])
+        step_w = weights[i][:len(self.w_names[i])]
+        if onedraw is None:
+            onedraw = self.onedraw
+
+        if back:
+            conc[o:o + n] = onedraw[i](step_w, conc[o:o + n], draw_size,
+                                       back=True)
+        else:
+            conc[o:o + n] = onedraw[i](step_w, conc[o:o + n], draw_size)
+        if prof is not None:
+            prof.add("back_draws" if back else "forward_draws",
+                     time.perf_counter() - t0)
+
+
+def _parameter_set(parameters):
+    """
+    This function will return an in-memory parameter set, given as a
+    ParameterStore or a dictionary of tables, as a ParameterStore
+    """
+    if parameters is None or isinstance(
+        parameters, smm.stat_mech_io.ParameterStore
+    ):
+        return parameters
+    return smm.stat_mech_io.ParameterStore(parameters)
+
+
+def _get_system(components, p=None, parameters=None):
+    """
+    This function will return a compiled GlassSystem for the components.
+    A previously compiled system is reused as long as none of its parameter
+    files have been changed
+    """
+    parameters = _parameter_set(parameters)
+    key = (
+        tuple(i for i in _COMP["formers"] if i in components),
+        tuple(i for i in _COMP["intermediates"] if i in components),
+        tuple(i for i in _COMP["modifiers"] if i in components),
+        float(np.squeeze(p)) if p else None,
+        parameters.fingerprint if parameters is not None else None,
+    )
+    system = _system_cache.get(key)
+    if system is None or not system.is_current():
+        system = GlassSystem(components, p, parameters)
+        _system_cache.put(key, system)
+    return system
+
+
+def _clear_caches():
+    """
+    This function will empty all in-process caches. It is called whenever
+    a parameter file is written
+    """
+    _system_cache.clear()
+    structure_cache.clear()
+    trajectory_cache.clear()
+    first_draw_cache.clear()
+    smm.stat_mech_io.table_cache.clear()
+    registry.refresh()
+
+
+def smg_structure(val, tg, p=None, cache=True, parameters=None):
     """
        This function will calculate the structural distribution of any glass
        composition. The function requires accurate relative reaction enthalpies
        for all possible chemical interactions in the glass melt.
 
     =============================================================================
-       smg_structure(val, tg, p = None)
+       smg_structure(val, tg, p = None, cache = True, parameters = None)
     =============================================================================
 
        where val is the chemical composition of the desired glass.
@@ -245,305 +1240,783 @@ def smg_structure(val, tg, p=None):
        ternary glass parameter optimization.
        This parameter should not be altered manually
 
+       cache can be set to False to bypass structure_cache and
+       trajectory_cache. Results are cached by composition, tg and the
+       parameters in use, so changed parameter files are always picked up.
+       structure_cache.stats() and structure_cache.clear() can be used to
+       inspect and empty the cache. Results can also be stored on disk and
+       shared between processes, see smg_enable_disk_cache.
+
+       parameters is an optional in-memory parameter set, which is used
+       instead of the parameter files. It is a python dictionary of tables
+       named like the parameter files, such as {"SiO2/Na": [...],
+       "MF/SiB": 1.2, "Al2O3/AlB": [...]}, or a ParameterStore. Tables that
+       are not in the set are read from the parameter files as usual, so a
+       sweep over enthalpy variants never writes any files.
+
+       The function returns a StructureResult, which can be used like a
+       python dictionary of species concentrations. Use to_dict() to get
+       a plain dictionary or the array attribute for the numpy array.
+
+       When many compositions of the same system are calculated, build a
+       GlassSystem once and use its structure function instead.
+
 
        Example:
 
        >>> res_structures = smg_structure({"Si":25, "B": 25, "Na":50}, tg=700)
+       >>> res_structures = smg_structure({"Si":70, "Na":30}, tg=700,
+                                          parameters={"SiO2/Na": H_variant})
     """
-    comp = {
-        "formers": ["Si", "B", "P"],
-        "intermediates": ["Al"],
-        "modifiers": ["Na", "K", "Li", "Ca"],
-    }
+    system = _get_system(val, p, parameters)
+    if not cache:
+        return system.structure(val, tg, cache=False)
+
+    names = system.draw_formers + system.modifiers
+    total = sum(val[i] for i in names)
+    key = (
+        system.fingerprint,
+        tuple(round(val[i] / total, 12) for i in names),
+        float(tg),
+    )
+    res = structure_cache.get(key)
+    if res is None:
+        if disk_cache is not None:
+            disk_key = disk_cache.make_key(*key)
+            stored = disk_cache.get(disk_key)
+            if stored is not None and stored[0] == system.species:
+                res = StructureResult(system.species, system.index, stored[1])
+        if res is None:
+            res = system.structure(val, tg)
+            if disk_cache is not None:
+                disk_cache.put(disk_key, res.species, res.array)
+        structure_cache.put(key, res)
+
+    return StructureResult(res.species, res.index, res.array.copy())
+
+
+@contextlib.contextmanager
+def smg_profile():
+    """
+       This function will record the time spent in each phase of the
+       structure calculations made inside a with block. The cumulative time
+       and number of calls are recorded for the composition parsing
+       ("parse"), _form_lookup ("form_lookup"), parameter file reads
+       ("data_load"), the first draw of the intermediates ("first_draw"),
+       the forward draws ("forward_draws") and the back-draws of the
+       intermediates ("back_draws"). Outside the with block nothing is
+       recorded. The profile is only active in the thread that entered the
+       with block, so several threads can profile their own calculations
+       at once. Calculations in other threads and processes are not
+       recorded.
 
-    formers_s = comp["formers"]
-    formers = []
-    f_conc = []
-    intermediates_s = comp["intermediates"]
-    intermediates = []
-    i_conc = []
-    modifiers_s = comp["modifiers"]
-    modifiers = []
-    m_conc = []
-
-    for i in range(len(formers_s)):
-        a_frac = _form_lookup(formers_s[i])[6]
-        try:
-            f_conc.append(val[formers_s[i]] / a_frac)
-        except:
-            pass
-        else:
-            formers.append(formers_s[i])
+    =============================================================================
+       smg_profile()
+    =============================================================================
 
-    for i in range(len(intermediates_s)):
-        try:
-            a_frac = _form_lookup(intermediates_s[i])[6]
-            i_conc.append(val[intermediates_s[i]] / a_frac)
-        except:
-            pass
-
-    if sum(i_conc) > sum(f_conc):
-        print(
-            "The results may be inaccurate since the concentration of"
-            "intermediates is higher than the concentration of formers"
-            )
-    for i in range(len(intermediates_s)):
-        a_frac = _form_lookup(intermediates_s[i])[6]
-        try:
-            f_conc.append(val[intermediates_s[i]] / a_frac)
-        except:
-            pass
-        else:
-            intermediates.append(intermediates_s[i])
+       The with block gives a Profile. Its summary function returns a
+       dictionary of phases with the calls and time in seconds, and
+       to_json returns the same as a JSON string.
 
-    for i in range(len(modifiers_s)):
-        try:
-            m_conc.append(val[modifiers_s[i]])
-        except:
-            pass
-        else:
-            modifiers.append(modifiers_s[i])
 
-    t_n_draws = (sum(m_conc) / sum(f_conc)) * 100
+       Example:
+
+       >>> with smg_profile() as prof:
+       >>>     smg_structure({"Si":25, "B": 25, "Na":50}, tg=700)
+       >>> prof.summary()
+    """
+    outer = _profile.get()
+    prof = smm.stat_mech_profile.Profile()
+    token = _profile.set(prof)
+    try:
+        yield prof
+    finally:
+        _profile.reset(token)
+        if outer is not None:
+            outer.merge(prof)
+
+
+def smg_set_root(path=None, parameters=None):
+    """
+       This function will set the directory holding the Data and Parameters
+       directories used by all functions of the package. By default the
+       directories installed with the package are used. All files are
+       opened by absolute paths, so the working directory of the process is
+       never changed and the functions can be called from many threads.
 
-    n_draws = int(t_n_draws)
+    =============================================================================
+       smg_set_root(path = None, parameters = None)
+    =============================================================================
 
-    if t_n_draws - n_draws > 0.5:
-        n_draws += 1
+       where path is the new root directory. None restores the directory of
+       the package. parameters is an optional directory, for example outside
+       site-packages, holding a user Parameters directory. Its files are
+       used before those of path, and smg_binary_par and smg_ternary_par
+       write their parameters to it. By default the directory named by the
+       STATMECHGLASS_PARAMETERS environment variable is used, if set.
 
-    # Starting concentrations:
-    structures = {}
-    for i in range(len(formers)):
-        start_conc = _form_lookup(formers[i])[4]
-        for i2 in start_conc:
-            structures[i2] = start_conc[i2] * f_conc[i] / sum(f_conc)
 
-    for i in range(len(intermediates)):
-        start_conc = _form_lookup(intermediates[i])[4]
-        for i2 in start_conc:
-            structures[i2] = (
-                            start_conc[i2] *
-                            f_conc[i + len(formers)] / sum(f_conc)
-                            )
+       Example:
 
-    if len(intermediates) > 0:
-        structure_val = []
-        for i in structures:
-            structure_val.append(structures[i])
+       >>> smg_set_root("/home/user/my_data")
+       >>> smg_set_root(parameters="/srv/glass/parameters")
+    """
+    global registry
+    if path is None:
+        path = _PACKAGE_DIR
+    if parameters is None:
+        parameters = os.environ.get("STATMECHGLASS_PARAMETERS")
+    registry = smm.stat_mech_io.Registry(path, parameters)
+    _clear_caches()
 
-        H_int = []
 
-        for i in formers:
-            w_data = list(_data_load(_form_lookup(i)[0], intermediates[0], 0))
-            for i2 in range(len(w_data)):
-                H_int.append(w_data[i2])
+def smg_use_parameter_store(path=None):
+    """
+       This function will read all enthalpy parameters and MF factors from a
+       single parameter store file instead of the Parameters directory. The
+       store is loaded once, in one read, and its content is checked against
+       the fingerprint saved with it. Data files are still read from the
+       Data directory. The worker processes of smg_structure_parallel get
+       the parameters of the store from this process, whatever their start
+       method is.
 
-        for i in intermediates:
-            w_data = list(_data_load(_form_lookup(i)[0], intermediates[0], 0))
-            for i2 in range(len(w_data)):
-                H_int.append(w_data[i2])
+    =============================================================================
+       smg_use_parameter_store(path = None)
+    =============================================================================
 
-        w_int = []
+       where path is a store written by smg_save_parameter_store. None
+       returns to reading the Parameters directory.
 
-        for i in range(len(H_int)):
-            w_int.append(math.exp(-H_int[i] / (tg * 0.008314)))
 
-        structure_alb = _form_lookup(intermediates[0])[10](
-            w_int, structure_val, formers[0]
-        )
+       Example:
 
-        indi = 0
-        for i in structures.keys():
-            structures[i] = structure_alb[indi]
-            indi += 1
+       >>> smg_save_parameter_store("parameters.json")
+       >>> smg_use_parameter_store("parameters.json")
+    """
+    global parameter_store
+    if path is None:
+        parameter_store = None
     else:
-        pass
+        parameter_store = smm.stat_mech_io.ParameterStore.load(path)
+    _clear_caches()
 
-    # Defining weighting factors
-    for m in range(n_draws):
-        weights = {}
-        draws = []
 
-        if len(intermediates) > 0:
-            for i in range(len(intermediates)):
-                if m == 0:
-                    formers.append(intermediates[i])
-                else:
-                    pass
-            for i in range(len(modifiers)):
-                m_weights = {}
-                m_draws = []
-                for i2 in range(len(formers)):
-                    if i2 == 0:
-                        f = 1
-                    else:
-                        if p:
-                            f = p
-                        else:
-                            f_p = formers[0] + formers[i2]
-                            f_path = "Parameters/MF"
-                            f = _data_load(f_path, f_p, 0)[0]
-                    path = _form_lookup(formers[i2])[0]
-                    w_names = _form_lookup(formers[i2])[5]
-                    Hi = _data_load(path, modifiers[i], 0)
-
-                    m_weights[w_names[0]] = 1 * f
-
-                    struc_keys = list(_form_lookup(formers[i2])[4].keys())
-                    m_draws.append(m_weights[w_names[0]] *
-                                   structures[struc_keys[0]])
-
-                    if len(Hi) > 1:
-                        for i3 in range(len(Hi)):
-                            m_weights[w_names[i3 + 1]] = (
-                                math.exp(-Hi[i3] / (tg * 0.008314))
-                            ) * f
-                            m_draws[i2] += (
-                                m_weights[w_names[i3 + 1]]
-                                * structures[struc_keys[i3 + 1]]
-                            )
-                    else:
-                        pass
-
-                for i4 in m_weights:
-                    try:
-                        weights[i4] += (
-                                        m_weights[i4] *
-                                        (m_conc[i] / sum(m_conc))
-                                        )
-                    except:
-                        weights[i4] = (
-                                        m_weights[i4] *
-                                        (m_conc[i] / sum(m_conc))
-                                        )
-
-                for i5 in range(len(m_draws)):
-                    try:
-                        draws[i5] += m_draws[i5]
-                    except:
-                        draws.append(m_draws[i5])
-
-            draws_norm = []
-            for i in range(len(draws)):
-                draws_norm.append((draws[i] / sum(draws)))
-
-            for i in range(len(formers)):
-                step_conc_ind = list(_form_lookup(formers[i])[4].keys())
-                step_conc = []
-
-                for i2 in step_conc_ind:
-                    step_conc.append(structures[i2])
-                step_w_ind = _form_lookup(formers[i])[5]
-                step_w = []
-                for i2 in step_w_ind:
-                    step_w.append(weights[i2])
-
-                onedraw_fun = _form_lookup(formers[i])[3]
-
-                new_conc = list(onedraw_fun(step_w, step_conc, draws_norm[i]))
-
-                for i3 in range(len(step_conc_ind)):
-                    structures[step_conc_ind[i3]] = new_conc[i3]
-
-                if formers[i] in intermediates:
-                    back_draw = -draws_norm[i] * 3
-
-                    for i in range(len(formers)):
-                        if formers[i] not in intermediates:
-
-                            step_conc_ind = list(_form_lookup(
-                                            formers[i])[4].keys()
-                                                            )
-                            step_conc = []
-
-                            for i2 in step_conc_ind:
-                                step_conc.append(structures[i2])
-
-                            step_w_ind = _form_lookup(formers[i])[5]
-                            step_w = []
-                            for i2 in step_w_ind:
-                                step_w.append(weights[i2])
-
-                            onedraw_fun = _form_lookup(formers[i])[3]
-                            new_conc = list(
-                                onedraw_fun(step_w, step_conc,
-                                            back_draw, back=True)
-                            )
-
-                            for i3 in range(len(step_conc_ind)):
-                                structures[step_conc_ind[i3]] = new_conc[i3]
+def smg_save_parameter_store(path, directory=None):
+    """
+       This function will write the parameters of a Parameters directory to
+       a single parameter store file, with a schema version and a
+       fingerprint of the content. The functions fitting parameters write
+       the directory, so the store must be saved again after new fits.
+
+    =============================================================================
+       smg_save_parameter_store(path, directory = None)
+    =============================================================================
+
+       where path is the store file to write and directory is the
+       Parameters directory to read. By default the parameters of the
+       directories set by smg_set_root are read.
+
+
+       Example:
+
+       >>> smg_save_parameter_store("parameters.json")
+    """
+    if directory is None:
+        store = smm.stat_mech_io.ParameterStore.from_registry(registry)
+    else:
+        store = smm.stat_mech_io.ParameterStore.from_directory(directory)
+    store.save(path)
+
+
+def smg_export_parameter_store(path, directory):
+    """
+       This function will write the parameters of a parameter store file as
+       CSV files in the Parameters directory layout, which can be used with
+       smg_set_root or edited by hand.
+
+    =============================================================================
+       smg_export_parameter_store(path, directory)
+    =============================================================================
+
+       where path is the store file to read and directory is the Parameters
+       directory to write.
+
+
+       Example:
+
+       >>> smg_export_parameter_store("parameters.json",
+       ...                            "/home/user/my_parameters/Parameters")
+    """
+    smm.stat_mech_io.ParameterStore.load(path).to_directory(directory)
+    _clear_caches()
+
+
+def smg_enable_disk_cache(path=None):
+    """
+       This function will turn on the persistent cache of smg_structure
+       results. The results are stored in an SQLite database keyed by
+       composition, tg and a hash of the parameter contents, so repeated runs
+       with unchanged parameters skip the calculation. The database may be
+       used by many processes at once.
+
+    =============================================================================
+       smg_enable_disk_cache(path = None)
+    =============================================================================
+
+       where path is the SQLite file to use. By default the cache is stored
+       in the user cache directory (~/.cache/StatMechGlass on Linux).
+
+
+       Example:
+
+       >>> smg_enable_disk_cache()
+       >>> smg_enable_disk_cache("/scratch/smg_cache.sqlite")
+    """
+    global disk_cache
+    disk_cache = smm.stat_mech_cache.DiskCache(path)
+    return disk_cache
+
+
+def smg_disable_disk_cache():
+    """
+    This function will turn off the persistent cache of smg_structure results.
+    The stored results are kept on disk
+    """
+    global disk_cache
+    disk_cache = None
+
+
+def smg_structure_batch(compositions, tg, components=None, p=None,
+                        parameters=None):
+    """
+       This function will calculate the structural distribution of many glass
+       compositions of the same glass system at once. The compositions are
+       drawn in lockstep using numpy, which is much faster than calling
+       smg_structure for each composition.
+
+    =============================================================================
+       smg_structure_batch(compositions, tg, components = None, p = None,
+                           parameters = None)
+    =============================================================================
+
+       where compositions is an (N x components) array of glass compositions
+       and components is a list of the component names of the columns,
+       such as ["Si", "B", "Na"]. compositions may also be a list of python
+       dictionaries with the same keys, in which case components can be
+       left out.
 
+       tg is the fictive temperature of the glasses. It can be a single value
+       used for all glasses or an array with one value per glass.
+
+       p is only used when the function is called by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+       The function returns a StructureResult with an (N x species) array.
+       Each species can be looked up by name to get its N concentrations.
+
+
+       Example:
+
+       >>> res_structures = smg_structure_batch([[25, 25, 50], [30, 30, 40]],
+                                                [700, 750], ["Si", "B", "Na"])
+    """
+    if components is None:
+        components = list(compositions[0].keys())
+        compositions = [[i[c] for c in components] for i in compositions]
+
+    return _get_system(components, p, parameters).structure_batch(
+        compositions, tg, components
+    )
+
+
+def smg_parameter_vector(components, p=None, parameters=None):
+    """
+       This function will return the names and values of all parameters of
+       a glass system as one vector, in the order used by
+       smg_structure_variants.
+
+    =============================================================================
+       smg_parameter_vector(components, p = None, parameters = None)
+    =============================================================================
+
+       where components is a list of the component names in the glass,
+       such as ["Si", "B", "Na"].
+
+       p and parameters are the same as for smg_structure_batch.
+
+       The function returns a list of parameter names, such as "SiO2/Na[0]"
+       for the first enthalpy of the SiO2/Na parameter file or "MF/SiB", and
+       an array of their values.
+
+
+       Example:
+
+       >>> names, values = smg_parameter_vector(["Si", "B", "Na"])
+    """
+    system = _get_system(components, p, parameters)
+    return list(system.par_names), np.array(system.par_values)
+
+
+def smg_structure_variants(compositions, tg, variants, components=None,
+                           p=None, parameters=None):
+    """
+       This function will calculate the structural distribution of a set of
+       glass compositions under many variants of the parameters, for
+       example to compare fits or propagate the uncertainty of the
+       enthalpies. All variants and compositions are calculated in one
+       vectorized pass.
+
+    =============================================================================
+       smg_structure_variants(compositions, tg, variants, components = None,
+                              p = None, parameters = None)
+    =============================================================================
+
+       where compositions, tg and components are the same as for
+       smg_structure_batch.
+
+       variants is a (K x parameters) array with one parameter vector per
+       row, in the order given by smg_parameter_vector.
+
+       p and parameters are the same as for smg_structure_batch. They set
+       the system the variants are taken from.
+
+       The function returns a StructureResult with a (K x N x species) array.
+       Each species can be looked up by name to get its (K x N)
+       concentrations.
+
+
+       Example:
+
+       >>> names, values = smg_parameter_vector(["Si", "B", "Na"])
+       >>> variants = values * np.random.normal(1, 0.05, (100, len(values)))
+       >>> res_structures = smg_structure_variants(comps, 700, variants,
+                                                   ["Si", "B", "Na"])
+    """
+    if components is None:
+        components = list(compositions[0].keys())
+        compositions = [[i[c] for c in components] for i in compositions]
+
+    return _get_system(components, p, parameters).structure_variants(
+        variants, compositions, tg, components
+    )
+
+
+def smg_iter_structures(compositions, tg, components=None, p=None,
+                        chunksize=1000, parameters=None):
+    """
+       This function will calculate the structural distribution of a stream
+       of glass compositions of the same glass system. The compositions are
+       read lazily in chunks, which are calculated with smg_structure_batch,
+       so the memory use is bounded by the chunk size no matter how long the
+       input is.
+
+    =============================================================================
+       smg_iter_structures(compositions, tg, components = None, p = None,
+                           chunksize = 1000, parameters = None)
+    =============================================================================
+
+       where compositions is any iterable or generator of python dictionaries
+       such as {"Si":25,"B":25,"Na":50} or of rows in the order of
+       components. components can be left out if the first composition is a
+       dictionary.
+
+       tg is the fictive temperature of the glasses. It can be a single value
+       used for all glasses or an iterable with one value per glass.
+
+       p is only used when the function is called by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       chunksize is the number of compositions calculated at a time.
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+       The function yields one StructureResult per composition in the same
+       order as the compositions.
+
+
+       Example:
+
+       >>> for res in smg_iter_structures(comp_generator, 700):
+       >>>     print(res["Si4"])
+    """
+    parameters = _parameter_set(parameters)
+    compositions = iter(compositions)
+    tg_iter = iter(tg) if np.iterable(tg) else None
+
+    while True:
+        chunk = list(itertools.islice(compositions, chunksize))
+        if len(chunk) == 0:
+            return
+
+        if components is None:
+            components = list(chunk[0].keys())
+        rows = [
+            [i[c] for c in components] if isinstance(i, Mapping) else i
+            for i in chunk
+        ]
+
+        if tg_iter is None:
+            tg_chunk = tg
         else:
+            tg_chunk = list(itertools.islice(tg_iter, len(rows)))
+            if len(tg_chunk) != len(rows):
+                raise ValueError("tg has fewer values than compositions")
 
-            for i in range(len(modifiers)):
-                m_weights = {}
-                m_draws = []
-                for i2 in range(len(formers)):
-                    if i2 == 0:
-                        f = 1
-                    else:
-                        if p:
-                            f = p
-                        else:
-                            f_p = formers[0] + formers[i2]
-                            f_path = "Parameters/MF"
-                            f = _data_load(f_path, f_p, 0)[0]
-                    path = _form_lookup(formers[i2])[0]
-                    w_names = _form_lookup(formers[i2])[5]
-                    Hi = _data_load(path, modifiers[i], 0)
-
-                    m_weights[w_names[0]] = 1 * f
-
-                    struc_keys = list(_form_lookup(formers[i2])[4].keys())
-                    m_draws.append(m_weights[w_names[0]] *
-                                   structures[struc_keys[0]])
-
-                    for i3 in range(len(Hi)):
-                        m_weights[w_names[i3 + 1]] = (
-                            math.exp(-Hi[i3] / (tg * 0.008314))
-                        ) * f
-                        m_draws[i2] += (
-                            m_weights[w_names[i3 + 1]] *
-                            structures[struc_keys[i3 + 1]]
-                        )
-
-                for i4 in m_weights:
-                    try:
-                        weights[i4] += (m_weights[i4] *
-                                        (m_conc[i] / sum(m_conc))
-                                        )
-                    except:
-                        weights[i4] = m_weights[i4] * (m_conc[i] / sum(m_conc))
-
-                for i5 in range(len(m_draws)):
-                    try:
-                        draws[i5] += m_draws[i5]
-                    except:
-                        draws.append(m_draws[i5])
-
-            draws_norm = []
-            for i in range(len(draws)):
-                draws_norm.append((draws[i] / sum(draws)))
-
-            for i in range(len(formers)):
-                step_conc_ind = list(_form_lookup(formers[i])[4].keys())
-                step_conc = []
-                for i2 in step_conc_ind:
-                    step_conc.append(structures[i2])
-
-                step_w_ind = _form_lookup(formers[i])[5]
-                step_w = []
-                for i2 in step_w_ind:
-                    step_w.append(weights[i2])
-
-                onedraw_fun = _form_lookup(formers[i])[3]
-
-                new_conc = list(onedraw_fun(step_w, step_conc, draws_norm[i]))
-
-                for i3 in range(len(step_conc_ind)):
-                    structures[step_conc_ind[i3]] = new_conc[i3]
-
-    return structures
+        res = smg_structure_batch(rows, tg_chunk, components, p, parameters)
+        for row in res.array:
+            yield StructureResult(res.species, res.index, row)
+
+
+class _SharedArray(np.ndarray):
+    """
+    Numpy array backed by shared memory. The shared memory stays mapped for
+    as long as the array or any view of it is in use
+    """
+
+    def __array_finalize__(self, obj):
+        self._shm = getattr(obj, "_shm", None)
+
+
+# Compiled system and shared result array of a worker process,
+# see smg_structure_parallel
+_worker_system = None
+_worker_shm = None
+_worker_out = None
+
+
+def _worker_init(components, p, parameters, shm_name, shape):
+    """
+    This function will compile the glass system once in each worker process
+    from the parameters resolved by the parent process, and attach the
+    shared result array
+    """
+    global _worker_system, _worker_shm, _worker_out
+    _worker_system = GlassSystem(components, p, parameters)
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_out = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+
+
+def _worker_batch(args):
+    """
+    This function will calculate one chunk of compositions in a worker and
+    write the structures into the shared result array
+    """
+    start, compositions, tg = args
+    res = _worker_system.structure_batch(compositions, tg).array
+    _worker_out[start:start + len(res)] = res
+    return len(res)
+
+
+def smg_structure_parallel(compositions, tg, components=None, p=None,
+                           workers=None, chunksize=1000, parameters=None):
+    """
+       This function will calculate the structural distribution of a large
+       set of glass compositions of the same glass system using several
+       processes. Each worker process receives the parameters resolved in
+       this process once, so the directories set by smg_set_root are used
+       whatever the start method of the processes is, and calculates
+       chunks of compositions with smg_structure_batch.
+       The workers write their results directly into shared memory, so
+       no results are pickled or copied.
+
+    =============================================================================
+       smg_structure_parallel(compositions, tg, components = None, p = None,
+                              workers = None, chunksize = 1000,
+                              parameters = None)
+    =============================================================================
+
+       where compositions, tg, components, p and parameters are the same as
+       for smg_structure_batch.
+
+       workers is the number of processes. By default one process per CPU
+       is used.
+
+       chunksize is the number of compositions sent to a worker at a time.
+
+       The function returns a StructureResult with an (N x species) array
+       in the same order as the compositions. The array is a view of the
+       shared memory written by the workers.
+
+
+       Example:
+
+       >>> res_structures = smg_structure_parallel(comps, 700,
+                                                   ["Si", "B", "Na"])
+    """
+    if components is None:
+        components = list(compositions[0].keys())
+        compositions = [[i[c] for c in components] for i in compositions]
+
+    comps = np.array(compositions, dtype=float, ndmin=2)
+    tg = np.broadcast_to(np.asarray(tg, dtype=float), (len(comps),))
+    system = _get_system(components, p, parameters)
+    shape = (len(comps), len(system.species))
+
+    if len(comps) == 0:
+        return StructureResult(system.species, system.index, np.zeros(shape))
+
+    shm = shared_memory.SharedMemory(create=True, size=8 * shape[0] * shape[1])
+    # Every view of out keeps out, and with it the shared memory, alive
+    out = _SharedArray(shape, dtype=np.float64, buffer=shm.buf)
+    out._shm = shm
+
+    # The workers get every table the parent resolved, so they use the
+    # same parameters whatever the start method of the processes is
+    resolved = smm.stat_mech_io.ParameterStore(system.tables)
+    chunks = [
+        (i, comps[i:i + chunksize], tg[i:i + chunksize])
+        for i in range(0, len(comps), chunksize)
+    ]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_worker_init,
+            initargs=(list(components), p, resolved, shm.name, shape),
+        ) as executor:
+            for n in executor.map(_worker_batch, chunks):
+                pass
+    finally:
+        # The memory stays mapped in this process until out is released
+        shm.unlink()
+
+    return StructureResult(system.species, system.index, out)
+
+
+def smg_composition_map(components, step, tg, p=None, parameters=None):
+    """
+       This function will calculate the structural distribution over the
+       whole composition diagram of a glass system, such as the ternary
+       Si-B-Na or a quaternary system. All grid points with the same former
+       ratio and modifier mix share one draw trajectory, which is drawn once
+       up to the grid point with the most modifier.
+
+    =============================================================================
+       smg_composition_map(components, step, tg, p = None,
+                           parameters = None)
+    =============================================================================
+
+       where components is a list of the component names in the glass,
+       such as ["Si", "B", "Na"].
+       Please refer to the README file for elaboration on the naming convention
+
+       step is the grid spacing in mol%. It must divide 100.
+
+       tg is the fictive temperature of the glasses.
+
+       p is only used when the function is called by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+       The function returns the (N x components) array of grid compositions
+       in mol%, with the columns in the order of components, and a
+       StructureResult with an (N x species) array whose rows are the
+       structures of the grid rows. Grid points without any formers have no
+       structure and are set to nan.
+
+
+       Example:
+
+       >>> comps, res_structures = smg_composition_map(["Si", "B", "Na"],
+                                                       0.5, 700)
+    """
+    return _get_system(components, p, parameters).composition_map(
+        step, tg, components
+    )
+
+
+def smg_structure_jacobian(val, tg, p=None, parameters=None):
+    """
+       This function will calculate the structural distribution of a glass
+       composition together with the derivatives of every species with
+       respect to the composition and to the fictive temperature. The
+       derivatives are propagated in forward mode through the draws, so a
+       single pass gives the structure and all its derivatives.
+
+    =============================================================================
+       smg_structure_jacobian(val, tg, p = None, parameters = None)
+    =============================================================================
+
+       where val is the chemical composition of the desired glass.
+       val should be a python dictionary in the form: {"Si":25,"B":25,"Na":50}.
+       Please refer to the README file for elaboration on the naming convention
+
+       tg is the fictive temperature of the glass
+
+       p is only used when the function is called by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+       The function returns three StructureResults: the structure, the
+       derivatives with respect to the components and the derivatives with
+       respect to tg. Looking up a species in the second gives its
+       derivative with respect to each component of val, in the order of
+       val. Species that are clamped to 0 in a draw have no derivative
+       from that draw. The number of draws is rounded to an integer, so
+       its part of the composition derivatives is taken from the change of
+       the structure over one more draw.
+
+
+       Example:
+
+       >>> res, d_comp, d_tg = smg_structure_jacobian({"Si":25, "B": 25,
+                                                       "Na":50}, tg=700)
+       >>> d_comp["Si4"]
+    """
+    system = _get_system(val, p, parameters)
+    res, d_comp, d_tg = system.structure_jacobian(val, tg)
+
+    return (res, StructureResult(system.species, system.index, d_comp),
+            StructureResult(system.species, system.index, d_tg))
+
+
+def smg_inverse_design(target, bounds, tg, n_best=5, it=200, popsize=15,
+                       seed=None, p=None, parameters=None):
+    """
+       This function will find the glass compositions whose structural
+       distribution best reproduces a target distribution. The compositions
+       are found by differential evolution, and every generation of
+       candidate compositions is calculated in one call to the batch
+       structure engine.
+
+    =============================================================================
+       smg_inverse_design(target, bounds, tg, n_best = 5, it = 200,
+                          popsize = 15, seed = None, p = None,
+                          parameters = None)
+    =============================================================================
+
+       where target is a python dictionary of the desired species
+       concentrations, such as {"Si4": 30, "B4": 20}. Species which are not
+       in target are not fitted.
+
+       bounds is a python dictionary of the allowed components and the
+       lower and upper limits of each component in mol%, such as
+       {"Si": (40, 80), "B": (0, 30), "Na": (10, 40)}. The compositions are
+       normalized to 100 mol%, and the bounds hold for the normalized
+       compositions: candidates outside them are penalized during the
+       search and never returned.
+
+       tg is the fictive temperature of the glasses
+
+       n_best is the number of compositions returned
+
+       it is the largest number of generations of the differential evolution,
+       popsize its population size per component and seed the random seed.
+
+       p is only used when the function is called by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+       The function returns a list of the n_best compositions as python
+       dictionaries, with the best composition first, and an array of the
+       sum of squared errors to the target of each composition. Fewer
+       compositions are returned if fewer candidates within the bounds were
+       found.
+
+
+       Example:
+
+       >>> comps, sse = smg_inverse_design({"Si4": 30, "B4": 20},
+                                           {"Si": (40, 80), "B": (0, 30),
+                                            "Na": (10, 40)}, 700)
+    """
+    components = list(bounds)
+    low = np.array([bounds[i][0] for i in components], dtype=float)
+    high = np.array([bounds[i][1] for i in components], dtype=float)
+    if low.sum() > 100 or high.sum() < 100:
+        raise ValueError("No composition within bounds sums to 100 mol%")
+    system = _get_system(components, p, parameters)
+    species = list(target)
+    goal = np.array([target[i] for i in species], dtype=float)
+    cols = [system.index[i] for i in species]
+    tried = []
+
+    def sse(x):
+        # x is a (components x candidates) array of one generation
+        comps = np.array(x, dtype=float, ndmin=2).T
+        total = comps.sum(axis=1)
+        norm = comps / total[:, None] * 100
+        structures = system.structure_batch(norm, tg, components).array
+        err = ((structures[:, cols] - goal) ** 2).sum(axis=1)
+        err = np.where(np.isnan(err), np.inf, err)
+        # Keep the candidates close to 100 mol% and the normalized
+        # compositions within the bounds
+        outside = (np.clip(low - norm, 0, None) ** 2 +
+                   np.clip(norm - high, 0, None) ** 2).sum(axis=1)
+        err = err + (total - 100) ** 2 + 1e3 * outside
+        tried.append((comps, err))
+        return err
+
+    scipy.optimize.differential_evolution(
+        sse,
+        [bounds[i] for i in components],
+        maxiter=it,
+        popsize=popsize,
+        seed=seed,
+        polish=False,
+        updating="deferred",
+        vectorized=True,
+    )
+
+    comps = np.concatenate([i[0] for i in tried])
+    comps = comps / comps.sum(axis=1)[:, None] * 100
+    err = np.concatenate([i[1] for i in tried])
+    comps, first = np.unique(np.round(comps, 6), axis=0, return_index=True)
+    err = err[first]
+    inside = np.all((comps >= low - 1e-6) & (comps <= high + 1e-6), axis=1)
+    err[~inside] = np.inf
+    order = np.argsort(err, kind="stable")[:min(n_best, inside.sum())]
+    best = [
+        {c: float(v) for c, v in zip(components, comps[i])} for i in order
+    ]
+    structures = system.structure_batch(comps[order], tg, components).array
+    best_sse = ((structures[:, cols] - goal) ** 2).sum(axis=1)
+
+    return best, best_sse
+
+
+def smg_tg_sweep(val, tg, p=None, parameters=None):
+    """
+       This function will calculate the structural distribution of a single
+       glass composition at many fictive temperatures. All temperatures are
+       calculated in one vectorized pass, so the parameter files are only
+       read once.
+
+    =============================================================================
+       smg_tg_sweep(val, tg, p = None, parameters = None)
+    =============================================================================
+
+       where val is the chemical composition of the desired glass.
+       val should be a python dictionary in the form: {"Si":25,"B":25,"Na":50}.
+       Please refer to the README file for elaboration on the naming convention
+
+       tg is an array of fictive temperatures
+
+       p is only used when the function is called by the
+       ternary glass parameter optimization.
+       This parameter should not be altered manually
+
+       parameters is an optional in-memory parameter set, see smg_structure.
+
+       The function returns an (n_tg x species) array. The columns are in the
+       same order as the species returned by smg_structure.
+
+
+       Example:
+
+       >>> res_structures = smg_tg_sweep({"Si":25, "B": 25, "Na":50},
+                                         np.linspace(600, 900, 100))
+    """
+    return _get_system(val, p, parameters).structure_sweep(val, tg)
 
 
 def smg_basin_binary(former, modifier, it=10, path_in=None):
@@ -652,12 +2125,8 @@ def smg_binary_par(former, modifier, it=10, path_in=None):
 
     path = _form_lookup(former, path_in)[0]
 
-    current_dir = os.getcwd()
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-    np.savetxt(os.path.join(path, "{}.csv".format(modifier)), par)
-
-    os.chdir(current_dir)
+    registry.write(path, {modifier: par})
+    _clear_caches()
 
     return print("Parameters {} saved to {} in {}".format(par, modifier, path))
 
@@ -789,18 +2258,8 @@ def smg_ternary_par(formers, modifier, it=10):
     name1 = formers[0] + formers[1]
     name2 = formers[1] + formers[0]
 
-    current_dir = os.getcwd()
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-    with open("{}{}.csv".format(path, name1), "w") as f:
-        f.write(str(par))
-        f.close()
-
-    with open("{}{}.csv".format(path, name2), "w") as f:
-        f.write(str(par_in))
-        f.close()
-
-    os.chdir(current_dir)
+    registry.write(path, {name1: par, name2: par_in})
+    _clear_caches()
 
     print("Parameter {} saved to {} in {}".format(par, name1, path))
     print("Parameter {} saved to {} in {}".format(par_in, name2, path))
@@ -838,7 +2297,7 @@ def smg_plot(comps, free_comp, tg, plt_save=False):
 
     for i in range(101):
         comps[free_comp] = i
-        structures = smg_structure(comps, tg)
+        structures = smg_structure(comps, tg).to_dict()
         if i == 0:
             structures_end = structures
             for key in structures_end:
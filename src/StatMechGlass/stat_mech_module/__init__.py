@@ -4,4 +4,8 @@
 from . import stat_mech_aluminoborate
 from . import stat_mech_borate
 from . import stat_mech_phosphate
-from . import stat_mech_silicate
\ No newline at end of file
+from . import stat_mech_silicate
+from . import stat_mech_cache
+from . import stat_mech_profile
+from . import stat_mech_io
+from . import stat_mech_util
@@ -3,6 +3,8 @@ import matplotlib.pyplot as plt
 import scipy.optimize
 import os
 
+from .stat_mech_util import where
+
 
 def AlB_first_draw(w1, start_conc, former):
 
@@ -509,6 +511,105 @@ def AlB_first_draw(w1, start_conc, former):
                     Q0AAA[-1], Al5[-1], Al4A[-1])
 
 
+def AlB_first_draw_batch(w1, start_conc, former):
+    """
+    Array version of AlB_first_draw. w1 is a (weights x glasses) array and
+    start_conc a (7 x glasses) array, so that the Al of many glasses with
+    different Al/former ratios is drawn at once. Glasses without Al or
+    without the former are returned unchanged. The rows of w1 and
+    start_conc may also be single values or Duals, and the seven rows of
+    the result are returned as a list.
+    """
+
+    w1 = [abs(i) for i in w1]
+    conc = list(start_conc)
+
+    if former == "Si":
+        w = [1, w1[0], w1[1], w1[2], w1[3]]
+    elif former == "B":
+        w = [1, w1[0], w1[1], w1[2], w1[3], 30]
+    else:
+        return conc
+
+    # Startværdier
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = conc[5] / conc[0]
+    start = conc[0]
+    active = (conc[5] > 0) & (conc[0] > 0)
+    Al_draw = 0
+
+    # Draw of all Al
+    while True:
+        Q_s, Q_a, Q2A, Q1AA, Q0AAA, Al5, Al4A = conc
+        active &= (Al_draw / 3) * 100 / (100 + (Al_draw / 3)) < Al5 * 100 / (
+            100 - Al4A
+        )
+        if not np.any(active):
+            break
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denom = (
+                Q_s * w[0]
+                + Q_a * w[1]
+                + Q2A * w[2]
+                + Q1AA * w[3]
+                + Al5 * w[4]
+            )
+            g_s = (Q_s * w[0]) * (1 / (r + 1)) / denom
+            g_a = (Q_a * w[1]) * (1 / (r + 1)) / denom
+            gQ2 = (Q2A * w[2]) * (1 / (r + 1)) / denom
+            gQ1 = (Q1AA * w[3]) * (1 / (r + 1)) / denom
+            gAl5 = (Al5 * w[4]) * (1 / (r + 1)) / denom
+
+            if former == "Si":
+                # Q4 and Q3 of the silicate
+                next_s = where(Q_s - g_s > 0, Q_s - g_s, 0)
+                next_a = where(Q_a + g_s - g_a > 0, Q_a + g_s - g_a, 0)
+                next_Q2A = where(Q2A + g_a - gQ2 > 0, Q2A + g_a - gQ2, 0)
+                next_Q1AA = where(Q1AA + gQ2 - gQ1 < 0, 0, Q1AA + gQ2 - gQ1)
+                next_Q0AAA = where(Q0AAA + gQ1 < 0, 0, Q0AAA + gQ1)
+                next_Al5 = where(Al5 - gAl5 > 0, Al5 - gAl5, 0)
+                next_Al4A = where(Al4A + gAl5 > 0, Al4A + gAl5, 0)
+            else:
+                # B3 and B4 of the borate
+                rgQ3 = g_s / (g_s + gQ2 + gQ1 + gAl5)
+                rgQ2 = gQ2 / (g_s + gQ2 + gQ1 + gAl5)
+                rgQ1 = gQ1 / (g_s + gQ2 + gQ1 + gAl5)
+                rgAl5 = gAl5 / (g_s + gQ2 + gQ1 + gAl5)
+
+                P = where(
+                    (Q_a + Q2A + 2 * Q1AA + 3 * Q0AAA) < start * w[5], 1, 0
+                )
+
+                t = Q_s - g_s + (-rgQ3) * g_a
+                next_s = where(t > 0, t, 0)
+                t = Q_a + g_s * P - g_a + (rgQ3 * P) * g_a
+                next_a = where(t > 0, t, 0)
+                t = (
+                    Q2A
+                    + g_a
+                    + g_s * (1 - P)
+                    - gQ2
+                    + (rgQ3 * (1 - P) - rgQ2) * g_a
+                )
+                next_Q2A = where(t > 0, t, 0)
+                t = Q1AA + gQ2 - gQ1 + (rgQ2 - rgQ1) * g_a
+                next_Q1AA = where(t < 0, 0, t)
+                t = Q0AAA + gQ1 + (rgQ1) * g_a
+                next_Q0AAA = where(t < 0, 0, t)
+                t = Al5 - gAl5 + (-rgAl5) * g_a
+                next_Al5 = where(t > 0, t, 0)
+                t = Al4A + gAl5 + (rgAl5) * g_a
+                next_Al4A = where(t > 0, t, 0)
+
+        new_conc = [next_s, next_a, next_Q2A, next_Q1AA,
+                    next_Q0AAA, next_Al5, next_Al4A]
+        conc = [where(active, i, i2) for i, i2 in zip(new_conc, conc)]
+        Al_draw += 1
+
+    return conc
+
+
 def AlB_one_draw(w, start_conc, draw_size):
 
     Al5_s = start_conc[0]
@@ -526,6 +627,23 @@ def AlB_one_draw(w, start_conc, draw_size):
     return next_Al5, next_Al4
 
 
+def AlB_one_draw_batch(w, start_conc, draw_size):
+    """
+    Draws once on the aluminium units of many glasses. Every concentration
+    and draw size may be a numpy array or a single value
+    """
+
+    Al5_s = start_conc[0]
+    Al4_s = start_conc[1]
+
+    p5 = draw_size
+
+    next_Al5 = where(Al5_s - p5 < 0, 0, Al5_s - p5)
+    next_Al4 = Al4_s + p5
+
+    return next_Al5, next_Al4
+
+
 def AlB_draw(w1, r, mod):
     w = np.array(
         [
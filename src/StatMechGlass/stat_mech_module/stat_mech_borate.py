@@ -10,6 +10,8 @@ import scipy.optimize
 import math
 import os
 
+from .stat_mech_util import where
+
 
 def B_onedraw(w, start_conc, draw_size, back=False):
 
@@ -19,10 +21,9 @@ def B_onedraw(w, start_conc, draw_size, back=False):
     B1_s = start_conc[3]
     B0_s = start_conc[4]
 
-    if (
-        (B4_s + B2_s + B1_s * 2 + B0_s * 3) /
-        (B3_s + B4_s + B2_s + B1_s * +B0_s)
-    ) < 0.428:
+    # No B4 is formed when the ratio is undefined
+    B_sum = B3_s + B4_s + B2_s + B1_s * +B0_s
+    if B_sum > 0 and (B4_s + B2_s + B1_s * 2 + B0_s * 3) / B_sum < 0.428:
         B4_B2 = 1
     else:
         B4_B2 = 0
@@ -138,6 +139,102 @@ def B_onedraw(w, start_conc, draw_size, back=False):
     return next_B3, next_B4, next_B2, next_B1, next_B0
 
 
+def B_onedraw_batch(w, start_conc, draw_size, back=False):
+    """
+    Draws once on the borate units of many glasses. Every weight, concentration
+    and draw size may be a numpy array or a single value
+    """
+
+    B3_s = start_conc[0]
+    B4_s = start_conc[1]
+    B2_s = start_conc[2]
+    B1_s = start_conc[3]
+    B0_s = start_conc[4]
+
+    # No B4 is formed when the ratio is undefined
+    B_sum = B3_s + B4_s + B2_s + B1_s * +B0_s
+    B4_B2 = where(
+        (B_sum > 0) &
+        ((B4_s + B2_s + B1_s * 2 + B0_s * 3) / where(B_sum > 0, B_sum, 1)
+         < 0.428), 1, 0
+    )
+
+    if back:
+
+        wB0 = 1 / w[3]
+        wB1 = 1 / w[2]
+        wB2 = 1 / w[1]
+        wB4 = 1 / w[0]
+
+        w_sum = B0_s * wB0 + B1_s * wB1 + B2_s * wB2 + B4_s * wB4
+
+        p_B0 = B0_s * wB0 / w_sum * draw_size
+        p_B1 = B1_s * wB1 / w_sum * draw_size
+        p_B2 = B2_s * wB2 / w_sum * draw_size
+        p_B4 = B4_s * wB4 / w_sum * draw_size
+
+        # Contribution to N4 from B
+        no_p = (p_B0 == 0) & (p_B1 == 0) & (p_B4 == 0)
+        p_sum = where(no_p, 1, p_B0 + p_B4 + p_B1)
+        CB0 = where(no_p, 0, p_B0 / p_sum)
+        CB1 = where(no_p, 0, p_B1 / p_sum)
+        CB4 = where(no_p, 0, p_B4 / p_sum)
+
+        # Evolution of borate Qn units
+        next_B0 = B0_s + p_B0 + (p_B2 * B4_B2 * CB0)
+        next_B0 = where(next_B0 < 0, 0, next_B0)
+
+        next_B1 = (B1_s - p_B0 + p_B1 + (CB1 * B4_B2 * p_B2) -
+                   (CB0 * B4_B2 * p_B2))
+        next_B1 = where(next_B1 < 0, 0, next_B1)
+
+        next_B2 = B2_s - p_B1 + p_B2 - (CB1 * B4_B2 * p_B2)
+        next_B2 = where(next_B2 < 0, 0, next_B2)
+
+        next_B4 = B4_s - (p_B2 * B4_B2) + p_B4 + (CB4 * B4_B2 * p_B2)
+        neg = next_B4 < 0
+        next_B4 = where(neg, 0, next_B4)
+        p_B4 = where(neg, -B4_s, p_B4)
+
+        next_B3 = B3_s - p_B4 - (p_B2 * (1 - B4_B2)) - (CB4 * B4_B2 * p_B2)
+        next_B3 = where(next_B3 < 0, 0, next_B3)
+
+    else:
+
+        w_sum = B3_s * w[0] + B4_s * w[1] + B2_s * w[2] + B1_s * w[3]
+
+        p_B3 = B3_s * w[0] / w_sum * draw_size
+        p_B4 = B4_s * w[1] / w_sum * draw_size
+        p_B2 = B2_s * w[2] / w_sum * draw_size
+        p_B1 = B1_s * w[3] / w_sum * draw_size
+
+        # Contribution to N4 from B
+        CB3 = p_B3 / (p_B3 + p_B2 + p_B1)
+        CB2 = p_B2 / (p_B3 + p_B2 + p_B1)
+        CB1 = p_B1 / (p_B3 + p_B2 + p_B1)
+
+        # Evolution of borate Qn units
+        next_B3 = B3_s - p_B3 - (p_B4 * CB3)
+        next_B3 = where(next_B3 < 0, 0, next_B3)
+
+        next_B4 = B4_s + (p_B3 * B4_B2) - p_B4
+        next_B4 = where(next_B4 < 0, 0, next_B4)
+
+        next_B2 = (
+            B2_s + (p_B3 * (1 - B4_B2)) + (p_B4 * CB3) +
+            p_B4 - p_B2 - (p_B4 * CB2)
+        )
+        next_B2 = where(next_B2 < 0, 0, next_B2)
+
+        next_B1 = B1_s + p_B2 - p_B1 + (p_B4 * CB2) - (p_B4 * CB1)
+        next_B1 = where(next_B1 < 0, 0, next_B1)
+
+        next_B0 = B0_s + p_B1 + (p_B4 * CB1)
+        next_B0 = where(next_B0 < 0, 0, next_B0)
+
+    return next_B3, next_B4, next_B2, next_B1, next_B0
+
+
 def B_back_onedraw(w, start_conc, draw_size):
 
     B3_s = start_conc[0]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+In-process and persistent caches used by the structure engine.
+
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """
+       Bounded least-recently-used cache with hit/miss statistics.
+       The cache is safe to use from several threads at once.
+
+    =============================================================================
+       LRUCache(maxsize=1024)
+    =============================================================================
+
+       where maxsize is the largest number of entries kept in the cache.
+       The least recently used entry is removed when the cache is full.
+
+       Example:
+
+       >>> cache = LRUCache(maxsize=128)
+       >>> cache.put("key", 1)
+       >>> cache.get("key")
+       >>> cache.stats()
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the hits, misses and size of the cache
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def user_cache_dir():
+    """
+    Returns the directory used for the persistent cache of StatMechGlass.
+    The directory follows XDG_CACHE_HOME on Linux and LOCALAPPDATA on Windows
+    """
+    if os.name == "nt":
+        root = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        root = os.environ.get("XDG_CACHE_HOME",
+                              os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(root, "StatMechGlass")
+
+
+class DiskCache:
+    """
+       Persistent cache of structure results stored in an SQLite database.
+       The database runs in WAL mode so that many processes can read and
+       write the same cache at once. Every process and thread uses its own
+       connection.
+
+    =============================================================================
+       DiskCache(path=None)
+    =============================================================================
+
+       where path is the SQLite file. By default the file structures.sqlite
+       in user_cache_dir() is used.
+
+       Example:
+
+       >>> cache = DiskCache()
+       >>> cache.put("key", ("Si4", "Si3"), np.array([50.0, 50.0]))
+       >>> species, array = cache.get("key")
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(user_cache_dir(), "structures.sqlite")
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS structures ("
+                "key TEXT PRIMARY KEY, species TEXT NOT NULL, "
+                "shape TEXT NOT NULL, data BLOB NOT NULL)"
+            )
+
+    def _connect(self):
+        """
+        Returns the connection of the current thread and process. A new
+        connection is opened after a fork
+        """
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=60)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Returns a stable string key for any parts with a deterministic repr
+        """
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the species and array stored under key, or None
+        """
+        row = self._connect().execute(
+            "SELECT species, shape, data FROM structures WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        species = tuple(row[0].split(","))
+        shape = tuple(int(i) for i in row[1].split(",") if i)
+        array = np.frombuffer(row[2], dtype=np.float64).reshape(shape)
+        return species, array.copy()
+
+    def put(self, key, species, array):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?)",
+                (key, ",".join(species),
+                 ",".join(str(i) for i in array.shape), array.tobytes()),
+            )
+
+    def clear(self):
+        with self._connect() as con:
+            con.execute("DELETE FROM structures")
+
+    def __len__(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM structures"
+        ).fetchone()[0]
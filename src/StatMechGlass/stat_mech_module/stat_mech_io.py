@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Reading of the data and parameter files of the package.
+
+"""
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+from types import MappingProxyType
+
+import numpy as np
+
+from .stat_mech_cache import LRUCache, user_cache_dir
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# Parsed CSV files keyed by path, modification time and size
+table_cache = LRUCache(maxsize=256)
+
+# Directory of the .npy copies of parsed CSV files. Set to None to always
+# parse the CSV files
+sidecar_dir = os.path.join(user_cache_dir(), "tables")
+
+
+def load_table(path):
+    """
+    Returns the numbers of a CSV file as a read-only 2D float array with one
+    row per line. Empty fields and the missing fields of short rows are nan.
+    Each file is parsed once, and the array is memoized until the file is
+    changed. The parsed array is also stored as a .npy file in sidecar_dir,
+    which later processes memory-map instead of parsing the file again
+    """
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    table = table_cache.get(key)
+    if table is None:
+        if sidecar_dir is None:
+            with open(path, "rb") as csvfile:
+                table = _parse_csv(csvfile.read())
+        else:
+            table = _sidecar_load(path, st, sidecar_dir)
+        table_cache.put(key, table)
+    return table
+
+
+def _parse_csv(data):
+    """
+    Returns the read-only float array of the bytes of a CSV file
+    """
+    text = io.StringIO(data.decode(), newline="")
+    rows = list(csv.reader(text, delimiter=",", quotechar="|"))
+    n_col = max((len(i) for i in rows), default=0)
+    table = np.full((len(rows), n_col), np.nan)
+    for r, row in enumerate(rows):
+        for c, value in enumerate(row):
+            if value.strip():
+                table[r, c] = float(value)
+    table.flags.writeable = False
+    return table
+
+
+def _sidecar_load(path, st, folder):
+    """
+    Returns the table of a CSV file from its memory-mapped .npy copy. The
+    copy is named by the content hash of the file and is used while the
+    modification time and size of the file are unchanged, or else while its
+    content hash is unchanged. Otherwise the file is parsed and a new copy
+    is stored. If the copy cannot be stored, the parsed array is returned
+    """
+    base = os.path.join(folder, hashlib.sha1(path.encode()).hexdigest())
+    try:
+        with open(base + ".json") as f:
+            meta = json.load(f)
+        if (meta["mtime_ns"], meta["size"]) == (st.st_mtime_ns, st.st_size):
+            return np.load(f"{base}-{meta['sha1']}.npy", mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        meta = None
+
+    with open(path, "rb") as csvfile:
+        data = csvfile.read()
+    digest = hashlib.sha1(data).hexdigest()
+    npy = f"{base}-{digest}.npy"
+    try:
+        table = np.load(npy, mmap_mode="r")
+    except (OSError, ValueError):
+        table = _parse_csv(data)
+        if table.size == 0:
+            return table
+        try:
+            os.makedirs(folder, exist_ok=True)
+            _write_atomic(npy, lambda f: np.save(f, table))
+            table = np.load(npy, mmap_mode="r")
+        except (OSError, ValueError):
+            return table
+
+    # Point the metadata at the copy of the current content
+    try:
+        if meta is not None and meta.get("sha1") != digest:
+            os.remove(f"{base}-{meta['sha1']}.npy")
+    except (OSError, KeyError):
+        pass
+    meta = {"path": path, "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+            "sha1": digest}
+    try:
+        _write_atomic(base + ".json",
+                      lambda f: f.write(json.dumps(meta).encode()))
+    except OSError:
+        pass
+    return table
+
+
+def _write_atomic(path, write):
+    """
+    Writes a file through a temporary file in the same directory, which
+    replaces path in one step so that readers never see a partial file
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive advisory lock on the file path, which is created if
+    needed, while the context is active. Other processes and threads
+    taking the same lock wait until it is released
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Registry:
+    """
+       Index of the CSV files in the Data and Parameters directories of a
+       root directory. The directories are scanned once, at first use or
+       when refresh is called, and the arrays are loaded lazily.
+
+    =============================================================================
+       Registry(root, parameter_root = None)
+    =============================================================================
+
+       where root is the directory holding the Data and Parameters
+       directories. Files are identified by their directory relative to
+       root, such as "Parameters/SiO2", and their name without extension,
+       such as "Na". parameter_root is an optional second directory with a
+       Parameters directory, such as a directory outside site-packages.
+       Its files take precedence over those of root, and new parameters
+       are written to it.
+
+       Example:
+
+       >>> registry = Registry("/path/to/StatMechGlass")
+       >>> registry.names("Parameters/SiO2")
+       >>> registry.shape("Data/SiO2", "Na")
+       >>> registry.load("Parameters/MF", "SiB")
+    """
+
+    trees = ("Data", "Parameters")
+
+    def __init__(self, root, parameter_root=None):
+        self.root = os.path.abspath(root)
+        self.parameter_root = None
+        if parameter_root is not None:
+            self.parameter_root = os.path.abspath(parameter_root)
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _roots(self, directory):
+        """
+        Returns the root directories of a directory in order of precedence
+        """
+        if (directory.strip("/").split("/")[0] == "Parameters"
+                and self.parameter_root is not None):
+            return [self.parameter_root, self.root]
+        return [self.root]
+
+    def refresh(self):
+        """
+        Forgets the index, so that the directories are scanned again at the
+        next use
+        """
+        with self._lock:
+            self._index = None
+
+    def _scan(self):
+        """
+        Returns the index of the directories, scanning them if needed
+        """
+        with self._lock:
+            if self._index is None:
+                index = {}
+                for tree in self.trees:
+                    for root in reversed(self._roots(tree)):
+                        top = os.path.join(root, tree)
+                        if not os.path.isdir(top):
+                            continue
+                        for system in sorted(os.listdir(top)):
+                            folder = os.path.join(top, system)
+                            if not os.path.isdir(folder):
+                                continue
+                            files = index.setdefault(f"{tree}/{system}", {})
+                            for i in os.listdir(folder):
+                                name, ext = os.path.splitext(i)
+                                if ext == ".csv":
+                                    path = os.path.join(folder, i)
+                                    files[name] = (path, _csv_shape(path))
+                self._index = {
+                    key: dict(sorted(files.items()))
+                    for key, files in sorted(index.items())
+                }
+            return self._index
+
+    def directories(self, tree=None):
+        """
+        Returns the indexed directories, optionally only those of one tree
+        """
+        return [
+            i for i in self._scan()
+            if tree is None or i.split("/")[0] == tree
+        ]
+
+    def names(self, directory):
+        """
+        Returns the names of the files in a directory, such as the modifiers
+        with parameters in "Parameters/SiO2"
+        """
+        return list(self._scan().get(directory.strip("/"), {}))
+
+    def mf_pairs(self):
+        """
+        Returns the former pairs with a MF factor, such as "SiB"
+        """
+        return self.names("Parameters/MF")
+
+    def __contains__(self, key):
+        directory, name = key
+        return name in self._scan().get(directory.strip("/"), {})
+
+    def candidates(self, directory, name):
+        """
+        Returns the paths a file may have, in order of precedence. A file in
+        parameter_root hides the file of the same name in root
+        """
+        return [
+            os.path.join(root, directory, f"{name}.csv")
+            for root in self._roots(directory)
+        ]
+
+    def find(self, directory, name):
+        """
+        Returns the absolute path of a file. Directories outside the index,
+        such as user data directories, are resolved against root. Files of
+        parameter_root are looked up on disk rather than in the index, so
+        that files written there by other processes are found at once. A
+        clear error is raised if the file does not exist
+        """
+        candidates = self.candidates(directory, name)
+        if len(candidates) > 1:
+            for path in candidates:
+                if os.path.isfile(path):
+                    return path
+        files = self._scan().get(directory.strip("/"))
+        if files is None or name not in files:
+            # The file may have been added since the scan
+            for root in self._roots(directory):
+                path = os.path.join(root, directory, f"{name}.csv")
+                if os.path.isfile(path):
+                    if files is not None:
+                        self.refresh()
+                    return path
+            if files is None:
+                raise FileNotFoundError(f"No {name}.csv in {directory}")
+            raise FileNotFoundError(
+                f"No {name}.csv in {directory}. The available files are: "
+                f"{', '.join(files) or 'none'}"
+            )
+        return files[name][0]
+
+    def shape(self, directory, name):
+        """
+        Returns the number of rows and columns of a file
+        """
+        files = self._scan().get(directory.strip("/"), {})
+        if name in files:
+            return files[name][1]
+        return load_table(self.find(directory, name)).shape
+
+    def load(self, directory, name):
+        """
+        Returns the contents of a file as a read-only 2D float array
+        """
+        return load_table(self.find(directory, name))
+
+    def write(self, directory, tables):
+        """
+        Writes a parameter set, a dictionary of file names and arrays, to a
+        directory of the first root. The set is written under an advisory
+        lock named after its files, and each file is replaced in one step,
+        so that readers never see a partial file
+        """
+        folder = os.path.join(self._roots(directory)[0], directory)
+        os.makedirs(folder, exist_ok=True)
+        lock = os.path.join(folder, f".{'-'.join(sorted(tables))}.lock")
+        with file_lock(lock):
+            for name, table in tables.items():
+                _write_atomic(
+                    os.path.join(folder, f"{name}.csv"),
+                    lambda f, t=table: np.savetxt(f, np.atleast_1d(t)),
+                )
+        self.refresh()
+
+
+def _csv_shape(path):
+    """
+    Returns the number of rows and the largest number of columns of a CSV
+    file without converting its contents
+    """
+    with open(path, newline="") as csvfile:
+        rows = [len(i) for i in csv.reader(csvfile, delimiter=",",
+                                           quotechar="|")]
+    return len(rows), max(rows, default=0)
+
+
+class ParameterStore:
+    """
+       Immutable table of all enthalpy parameters and MF factors, stored in
+       a single JSON file with a schema version and a fingerprint of the
+       content. The Parameters directory layout is the import and export
+       format of the store.
+
+    =============================================================================
+       ParameterStore(tables)
+    =============================================================================
+
+       where tables is a dictionary of directory and file names, such as
+       "SiO2/Na" or "MF/SiB", and their contents. Single values and 1D
+       arrays are stored as one column, like the parameter files. Use
+       from_directory or load to create a store from files.
+
+       Example:
+
+       >>> store = ParameterStore.from_directory("StatMechGlass/Parameters")
+       >>> store.save("parameters.json")
+       >>> store = ParameterStore.load("parameters.json")
+       >>> store.get("SiO2", "Na")
+    """
+
+    schema = 1
+
+    def __init__(self, tables, path=None):
+        data = {}
+        for key in sorted(tables):
+            if len(key.split("/")) != 2:
+                raise ValueError(f"{key} is not a directory and file name, "
+                                 "such as SiO2/Na")
+            table = np.array(tables[key], dtype=float)
+            if table.ndim < 2:
+                table = table.reshape(-1, 1)
+            table.flags.writeable = False
+            data[key] = table
+        self.tables = MappingProxyType(data)
+        self.path = path
+        self.fingerprint = hashlib.sha1(
+            json.dumps(self._content(), sort_keys=True).encode()
+        ).hexdigest()
+
+    def __reduce__(self):
+        return (type(self), (dict(self.tables), self.path))
+
+    def _content(self):
+        return {key: table.tolist() for key, table in self.tables.items()}
+
+    @classmethod
+    def from_directory(cls, path):
+        """
+        Returns a store of the CSV files in the subdirectories of a
+        Parameters directory
+        """
+        tables = {}
+        for system in sorted(os.listdir(path)):
+            folder = os.path.join(path, system)
+            if not os.path.isdir(folder):
+                continue
+            for i in sorted(os.listdir(folder)):
+                name, ext = os.path.splitext(i)
+                if ext == ".csv":
+                    tables[f"{system}/{name}"] = load_table(
+                        os.path.join(folder, i)
+                    )
+        return cls(tables)
+
+    @classmethod
+    def from_registry(cls, registry):
+        """
+        Returns a store of the parameter files of a registry
+        """
+        tables = {}
+        for directory in registry.directories("Parameters"):
+            for name in registry.names(directory):
+                tables[f"{directory.split('/')[1]}/{name}"] = registry.load(
+                    directory, name
+                )
+        return cls(tables)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the store saved in a JSON file. The schema version and the
+        fingerprint of the content are checked
+        """
+        path = os.path.abspath(path)
+        with open(path) as f:
+            content = json.load(f)
+        if content.get("schema") != cls.schema:
+            raise ValueError(
+                f"{path} has schema version {content.get('schema')}, "
+                f"expected {cls.schema}"
+            )
+        store = cls(content["tables"], path)
+        if store.fingerprint != content.get("fingerprint"):
+            raise ValueError(f"The fingerprint of {path} does not match its "
+                             "content")
+        return store
+
+    def save(self, path):
+        """
+        Writes the store to a JSON file
+        """
+        content = {
+            "schema": self.schema,
+            "fingerprint": self.fingerprint,
+            "tables": self._content(),
+        }
+        _write_atomic(os.path.abspath(path),
+                      lambda f: f.write(json.dumps(content).encode()))
+
+    def to_directory(self, path):
+        """
+        Writes the store as CSV files in the Parameters directory layout
+        """
+        for key, table in self.tables.items():
+            system, name = key.split("/")
+            os.makedirs(os.path.join(path, system), exist_ok=True)
+            np.savetxt(os.path.join(path, system, f"{name}.csv"), table,
+                       delimiter=",")
+
+    def names(self, system):
+        """
+        Returns the names of the tables of a directory, such as the
+        modifiers with parameters in "SiO2"
+        """
+        return [
+            key.split("/")[1] for key in self.tables
+            if key.split("/")[0] == system
+        ]
+
+    def get(self, system, name):
+        """
+        Returns a table as a read-only 2D float array
+        """
+        try:
+            return self.tables[f"{system}/{name}"]
+        except KeyError:
+            raise KeyError(
+                f"No {name} parameters for {system} in the parameter store. "
+                f"The available parameters are: "
+                f"{', '.join(self.names(system)) or 'none'}"
+            ) from None
+
+    def __contains__(self, key):
+        system, name = key
+        return f"{system}/{name}" in self.tables
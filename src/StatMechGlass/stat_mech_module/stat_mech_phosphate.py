@@ -10,6 +10,8 @@ import scipy.optimize
 import math
 import os
 
+from .stat_mech_util import where
+
 
 def P_onedraw(w, start_conc, draw_size, back=False):
 
@@ -49,6 +51,31 @@ def P_onedraw(w, start_conc, draw_size, back=False):
     return next_Q3, next_Q2, next_Q1, next_Q0
 
 
+def P_onedraw_batch(w, start_conc, draw_size, back=False):
+    """
+    Draws once on the Qn units of many glasses. Every weight, concentration
+    and draw size may be a numpy array or a single value
+    """
+
+    Q3_s = start_conc[0]
+    Q2_s = start_conc[1]
+    Q1_s = start_conc[2]
+    Q0_s = start_conc[3]
+
+    w_sum = (Q3_s * w[0]) + (Q2_s * w[1]) + (Q1_s * w[2])
+
+    p3 = Q3_s * w[0] / w_sum * draw_size
+    p2 = Q2_s * w[1] / w_sum * draw_size
+    p1 = Q1_s * w[2] / w_sum * draw_size
+
+    next_Q3 = where(Q3_s - p3 < 0, 0, Q3_s - p3)
+    next_Q2 = where(Q2_s + p3 - p2 < 0, 0, Q2_s + p3 - p2)
+    next_Q1 = where(Q1_s + p2 - p1 < 0, 0, Q1_s + p2 - p1)
+    next_Q0 = where(Q0_s + p1 < 0, 0, Q0_s + p1)
+
+    return next_Q3, next_Q2, next_Q1, next_Q0
+
+
 def P_draw(H1, tg, frac=None, s_plt=False, s_dat=False, p=False):
     """
        This function will plot the SRO scale structural evolution of silicate
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the phases of the structure engine.
+
+"""
+import json
+import threading
+
+
+class Profile:
+    """
+       Cumulative time and number of calls of each phase of the structure
+       engine, recorded while the profile is active.
+
+    =============================================================================
+       Profile()
+    =============================================================================
+
+       The phases are "parse", "form_lookup", "data_load", "first_draw",
+       "forward_draws" and "back_draws". Phases may be nested, so the time
+       of "form_lookup" includes the "data_load" calls it makes.
+
+       Example:
+
+       >>> prof = Profile()
+       >>> prof.add("data_load", 0.01)
+       >>> prof.summary()
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds, calls=1):
+        with self._lock:
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+            self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def merge(self, other):
+        """
+        Adds the times and calls of another profile to this profile
+        """
+        for phase, i in other.summary().items():
+            self.add(phase, i["time"], i["calls"])
+
+    def summary(self):
+        """
+        Returns a dictionary of phases with the number of calls and the
+        total time in seconds of each phase
+        """
+        with self._lock:
+            return {
+                phase: {"calls": self.calls[phase], "time": self.times[phase]}
+                for phase in self.times
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def __repr__(self):
+        lines = [f"{'phase':<16}{'calls':>10}{'time [s]':>14}"]
+        for phase, i in self.summary().items():
+            lines.append(f"{phase:<16}{i['calls']:>10}{i['time']:>14.6f}")
+        return "\n".join(lines)
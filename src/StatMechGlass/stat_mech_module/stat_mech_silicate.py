@@ -10,6 +10,8 @@ import math
 import os
 import scipy.optimize
 
+from .stat_mech_util import where
+
 
 def Si_onedraw(w, start_conc, draw_size, back=False):
 
@@ -125,6 +127,68 @@ def Si_onedraw(w, start_conc, draw_size, back=False):
     return next_Q4, next_Q3, next_Q2, next_Q1, next_Q0
 
 
+def Si_onedraw_batch(w, start_conc, draw_size, back=False):
+    """
+    Draws once on the Qn units of many glasses. Every weight, concentration
+    and draw size may be a numpy array or a single value
+    """
+
+    Q4_s = start_conc[0]
+    Q3_s = start_conc[1]
+    Q2_s = start_conc[2]
+    Q1_s = start_conc[3]
+    Q0_s = start_conc[4]
+
+    if back:
+
+        wQ0 = 1 / w[3]
+        wQ1 = 1 / w[2]
+        wQ2 = 1 / w[1]
+        wQ3 = 1 / w[0]
+
+        w_sum = (Q0_s * wQ0) + (Q1_s * wQ1) + (Q2_s * wQ2) + (Q3_s * wQ3)
+
+        p0 = Q0_s * wQ0 / w_sum * draw_size
+        p1 = Q1_s * wQ1 / w_sum * draw_size
+        p2 = Q2_s * wQ2 / w_sum * draw_size
+        p3 = Q3_s * wQ3 / w_sum * draw_size
+
+        neg = Q0_s + p0 < 0
+        next_Q0 = where(neg, 0, Q0_s + p0)
+        p1 = where(neg, p1 + Q0_s + p0, p1)
+
+        neg = Q1_s - p0 + p1 < 0
+        next_Q1 = where(neg, 0, Q1_s - p0 + p1)
+        p2 = where(neg, p2 + Q1_s + p1, p2)
+
+        neg = Q2_s - p1 + p2 < 0
+        next_Q2 = where(neg, 0, Q2_s - p1 + p2)
+        p3 = where(neg, p3 + Q2_s + p2, p3)
+
+        neg = Q3_s - p2 + p3 < 0
+        next_Q3 = where(neg, 0, Q3_s - p2 + p3)
+        p3 = where(neg, p3 + Q3_s + p3, p3)
+
+        next_Q4 = where(Q4_s - p3 < 0, 0, Q4_s - p3)
+
+    else:
+
+        w_sum = (Q4_s * w[0]) + (Q3_s * w[1]) + (Q2_s * w[2]) + (Q1_s * w[3])
+
+        p4 = Q4_s * w[0] / w_sum * draw_size
+        p3 = Q3_s * w[1] / w_sum * draw_size
+        p2 = Q2_s * w[2] / w_sum * draw_size
+        p1 = Q1_s * w[3] / w_sum * draw_size
+
+        next_Q4 = where(Q4_s - p4 < 0, 0, Q4_s - p4)
+        next_Q3 = where(Q3_s + p4 - p3 < 0, 0, Q3_s + p4 - p3)
+        next_Q2 = where(Q2_s + p3 - p2 < 0, 0, Q2_s + p3 - p2)
+        next_Q1 = where(Q1_s + p2 - p1 < 0, 0, Q1_s + p2 - p1)
+        next_Q0 = where(Q0_s + p1 < 0, 0, Q0_s + p1)
+
+    return next_Q4, next_Q3, next_Q2, next_Q1, next_Q0
+
+
 def Si_draw(H1, tg, frac=None, s_plt=False, s_dat=False, p=False):
     """
        This function will plot the SRO scale structural evolution of silicate
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the draw functions of the glass modules.
+
+"""
+import numpy as np
+
+
+class Dual:
+    """
+       A value together with its derivatives along several directions, for
+       forward mode differentiation of the draw functions.
+
+    =============================================================================
+       Dual(v, d)
+    =============================================================================
+
+       where v is the value, a single value or a numpy array, and d is a
+       numpy array of derivatives with one leading entry per direction,
+       such as the unit vector of an input. Sums, products and quotients
+       with other Duals and plain values carry the derivatives along.
+
+       Comparisons compare the values, so the draw functions take the same
+       branches as for plain values. A concentration that is clamped to 0
+       by where is a plain 0, and has no derivatives.
+
+       Example:
+
+       >>> x = Dual(2.0, np.array([1.0, 0.0]))
+       >>> y = Dual(3.0, np.array([0.0, 1.0]))
+       >>> (x * y).d
+    """
+
+    __slots__ = ("v", "d")
+
+    # Lets numpy values defer to the reflected operators below
+    __array_ufunc__ = None
+
+    def __init__(self, v, d):
+        self.v = v
+        self.d = d
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.v + other.v, self.d + other.d)
+        return Dual(self.v + other, self.d)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.v - other.v, self.d - other.d)
+        return Dual(self.v - other, self.d)
+
+    def __rsub__(self, other):
+        return Dual(other - self.v, -self.d)
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.v * other.v,
+                        self.d * other.v + self.v * other.d)
+        return Dual(self.v * other, self.d * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            q = self.v / other.v
+            return Dual(q, (self.d - q * other.d) / other.v)
+        return Dual(self.v / other, self.d / other)
+
+    def __rtruediv__(self, other):
+        q = other / self.v
+        return Dual(q, -q * self.d / self.v)
+
+    def __neg__(self):
+        return Dual(-self.v, -self.d)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Dual(abs(self.v), self.d * np.sign(self.v))
+
+    def __lt__(self, other):
+        return self.v < value(other)
+
+    def __le__(self, other):
+        return self.v <= value(other)
+
+    def __gt__(self, other):
+        return self.v > value(other)
+
+    def __ge__(self, other):
+        return self.v >= value(other)
+
+    def __eq__(self, other):
+        return self.v == value(other)
+
+    def __ne__(self, other):
+        return self.v != value(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Dual({self.v!r}, {self.d!r})"
+
+
+def value(x):
+    """
+    Returns the value of a Dual, and any other value unchanged
+    """
+    return x.v if isinstance(x, Dual) else x
+
+
+def where(condition, x, y):
+    """
+    Returns x where condition holds and y elsewhere, like np.where. Single
+    values are selected without creating arrays, so that the draw functions
+    are as fast for one glass as for many. Where condition is an array and
+    x or y is a Dual, the derivatives are selected along with the values
+    """
+    if isinstance(condition, (bool, np.bool_)):
+        return x if condition else y
+    if isinstance(x, Dual) or isinstance(y, Dual):
+        return Dual(
+            np.where(condition, value(x), value(y)),
+            np.where(condition, x.d if isinstance(x, Dual) else 0,
+                     y.d if isinstance(y, Dual) else 0),
+        )
+    return np.where(condition, x, y)